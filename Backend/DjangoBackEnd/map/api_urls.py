@@ -0,0 +1,13 @@
+from django.urls import path
+from . import views
+from .views import serve_geojson, serve_bus, busroute, location_geojson
+
+# Mounted under 'api/' by map/urls.py
+urlpatterns = [
+    path('filter-options/', views.get_filter_options, name='filter_options'),
+    path('serve_geojson/', serve_geojson, name='serve_geojson'),
+    path('location_geojson/', location_geojson, name='serve_geojson'),
+    path('serve_bus/', serve_bus, name='serve_bus'),
+    path('busroute/', busroute, name='busroute'),
+    path('stored_collisions/', views.get_stored_collisions_view, name='api_get_collisions'),
+]
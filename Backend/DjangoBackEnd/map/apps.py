@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MapConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'map'
+
+    def ready(self):
+        from map.triggers import ensure_projection_triggers
+        post_migrate.connect(ensure_projection_triggers, sender=self)
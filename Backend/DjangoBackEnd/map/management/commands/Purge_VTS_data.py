@@ -1,28 +1,29 @@
-import os
-import django
 import logging
 from django.core.management.base import BaseCommand
-from map.models import TransitInformation, ApiMetadata
-
-# Set up Django settings
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "my_project.settings")
-django.setup()
+from django.db import connection, transaction
+from map.models import VtsSituation, ApiMetadata, DetectedCollision
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = "Delete all data from TransitInformation and ApiMetadata tables."
+    help = "Delete all data from VtsSituation (and their DetectedCollision rows) and ApiMetadata tables."
+
+    def delete_all(self, cursor, model):
+        """Delete every row of a model's table with one DELETE statement and return the row count."""
+        cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+        return cursor.rowcount
 
     def handle(self, *args, **kwargs):
         try:
-            # Delete all data from TransitInformation
-            transit_count = TransitInformation.objects.count()
-            TransitInformation.objects.all().delete()
-            logger.info(f"Deleted {transit_count} records from TransitInformation.")
-            
-            # Delete all data from ApiMetadata
-            metadata_count = ApiMetadata.objects.count()
-            ApiMetadata.objects.all().delete()
+            # One plain DELETE per table: no count() scan, no loading of primary keys
+            # and no per-object signals. Collisions go first, since a raw DELETE doesn't
+            # run the on_delete=CASCADE from VtsSituation like delete() would.
+            with transaction.atomic(), connection.cursor() as cursor:
+                collision_count = self.delete_all(cursor, DetectedCollision)
+                transit_count = self.delete_all(cursor, VtsSituation)
+                metadata_count = self.delete_all(cursor, ApiMetadata)
+            logger.info(f"Deleted {collision_count} records from DetectedCollision.")
+            logger.info(f"Deleted {transit_count} records from VtsSituation.")
             logger.info(f"Deleted {metadata_count} records from ApiMetadata.")
 
             self.stdout.write(self.style.SUCCESS("Successfully deleted all transit data."))
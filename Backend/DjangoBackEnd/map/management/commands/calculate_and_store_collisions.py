@@ -13,26 +13,30 @@ import time
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from map.models import DetectedCollision
-from map.utils import calculate_collisions_for_storage # Import the calculation function
+from map.utils import insert_new_collisions # Import the calculation function
 import logging
 logger = logging.getLogger(__name__)
 
+# 300 meters can detect ferry abnormalies
+DEFAULT_TOLERANCE_METERS = 300
+
 class Command(BaseCommand):
     """
     Handles the recalculation and storage of detected collisions.
 
-    It calls an external function `calculate_collisions_for_storage` to
-    perform the geographic proximity analysis based on the provided tolerance.
-    The results are then processed and stored in the `DetectedCollision` model.
+    It calls an external function `insert_new_collisions` to perform the
+    geographic proximity analysis based on the provided tolerance and store
+    the results in the `DetectedCollision` model, all inside the database.
 
     Key features:
     - Customizable proximity tolerance via command-line argument.
     - Option to clear existing collision data before inserting new results (default).
     - Option to preserve existing data and only insert new, unique collision pairs.
     - Uses `transaction.atomic` for database operations to ensure consistency.
-    - Uses `bulk_create` for efficient insertion of new records.
-    - Handles potential duplicate collision pairs (both against existing data
-      if not clearing, and within the newly calculated batch).
+    - Uses a single INSERT OR IGNORE ... SELECT, so no rows are loaded into Python.
+    - Duplicate collision pairs (against existing data if not clearing, or within
+      the calculated batch) are skipped by the unique (transit_information,
+      bus_route) index.
     """
     help = 'Recalculates and updates the stored detected collisions between VTS points and bus routes.'
 
@@ -40,8 +44,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--tolerance',
             type=int,
-            # 300 meters can detect ferry abnormalies
-            default=300, # Default tolerance if not specified
+            default=DEFAULT_TOLERANCE_METERS, # Default tolerance if not specified
             help='Distance tolerance in meters for collision detection.',
         )
         parser.add_argument(
@@ -51,91 +54,50 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        tolerance = options['tolerance']
         clear_existing = not options['no_clear']
-        start_time = time.time()
-
-        logger.info(f"Running update_collisions. Tolerance={tolerance}, Clear Existing Data={clear_existing}")
         self.stdout.write(f"Option --no-clear specified: {options['no_clear']}. Clear Existing Data set to: {clear_existing}")
+        self.store_collisions(options['tolerance'], clear_existing)
+
+    def store_collisions(self, tolerance, clear_existing=True):
+        """
+        Calculates the collisions and stores the new ones.
+        run_cron calls this on its own Command instance instead of going through call_command.
 
-        # --- Calculate New Collisions ---
-        calculated_data = calculate_collisions_for_storage(tolerance)
-        # ... (error checking for calculated_data) ...
-        calculation_time = time.time()
-        self.stdout.write(f"Calculation finished in {calculation_time - start_time:.2f} seconds. Found {len(calculated_data)} potential collisions.")
+        Returns:
+            list: IDs of the DetectedCollision rows created by this run.
+        """
+        start_time = time.time()
+        logger.info(f"Running update_collisions. Tolerance={tolerance}, Clear Existing Data={clear_existing}")
 
-        created_count = 0
-        skipped_count = 0 # For duplicates within calculation OR already existing
+        created_ids = []
 
-        # --- Database Operations ---
+        # --- Calculate and Store New Collisions ---
+        # One INSERT OR IGNORE ... SELECT: the database finds the collisions and the unique
+        # (transit_information, bus_route) index skips pairs that are already stored.
         try:
             with transaction.atomic():
-                existing_pairs_set = set() # Initialize
                 if clear_existing:
                     self.stdout.write("Clearing existing collision data...")
                     deleted_count, _ = DetectedCollision.objects.all().delete()
                     self.stdout.write(f"Deleted {deleted_count} old collision records.")
                 else:
-                    # --- If not clearing, get existing pairs to avoid re-inserting ---
-                    self.stdout.write(self.style.WARNING("Skipping clearing. Fetching existing collision pairs..."))
-                    # Fetch tuple pairs for efficient lookup
-                    existing_pairs = DetectedCollision.objects.values_list(
-                        'transit_information_id',
-                        'bus_route_id'
-                    )
-                    existing_pairs_set = set(existing_pairs)
-                    self.stdout.write(f"Found {len(existing_pairs_set)} existing pairs in the database.")
-                    # --- End fetching existing pairs ---
-
-                self.stdout.write("Preparing new collision data for storage...")
-                collisions_to_create = []
-                # Use a separate set to track pairs added *in this specific run*
-                # to handle potential duplicates within calculated_data itself.
-                seen_in_this_run = set()
-
-                for data in calculated_data:
-                    pair = (data['transit_id'], data['route_id'])
-
-                    # --- Check 1: Already exists in DB (only if not clearing) ---
-                    if not clear_existing and pair in existing_pairs_set:
-                        skipped_count += 1
-                        continue # Skip if it already exists in the database
-
-                    # --- Check 2: Already added in this calculation run ---
-                    if pair in seen_in_this_run:
-                        # This handles duplicates *within* calculated_data
-                        # Might indicate an issue in calculation logic if it happens often
-                        logger.warning(f"Duplicate pair {pair} found within calculated_data. Skipping.")
-                        skipped_count += 1
-                        continue # Skip if already processed in this loop
-
-                    # --- If new, add to create list and track ---
-                    collisions_to_create.append(
-                        DetectedCollision(
-                            transit_information_id=data['transit_id'],
-                            bus_route_id=data['route_id'],
-                            transit_lon=data['transit_lon'],
-                            transit_lat=data['transit_lat'],
-                            tolerance_meters=tolerance
-                            # published_to_mqtt defaults to False
-                        )
-                    )
-                    seen_in_this_run.add(pair) # Track pair added in this run
+                    self.stdout.write(self.style.WARNING("Skipping clearing. Existing collision pairs are kept and not re-inserted."))
 
-                if collisions_to_create:
-                    self.stdout.write(f"Bulk creating {len(collisions_to_create)} genuinely new collision records...")
-                    created_objects = DetectedCollision.objects.bulk_create(collisions_to_create)
-                    created_count = len(created_objects)
-                    self.stdout.write(f"Successfully stored {created_count} new collision records (marked as unpublished).")
+                self.stdout.write(f"Calculating and storing collisions (Tolerance: {tolerance}m)...")
+                created_ids = insert_new_collisions(tolerance)
+                if created_ids:
+                    self.stdout.write(f"Successfully stored {len(created_ids)} new collision records (marked as unpublished).")
                 else:
                      self.stdout.write("No genuinely new collision records found to store.")
 
         except Exception as e:
             logger.error(f"Database operation failed: {e}", exc_info=True) # Log traceback
+            created_ids = [] # The transaction was rolled back
             self.stderr.write(self.style.ERROR(f"Database operation failed: {e}"))
 
         end_time = time.time()
         self.stdout.write(self.style.SUCCESS(
             f"Collision update finished in {end_time - start_time:.2f} seconds. "
-            f"Stored: {created_count}. Skipped existing/duplicates: {skipped_count}."
-        ))
\ No newline at end of file
+            f"Stored: {len(created_ids)}."
+        ))
+        return created_ids
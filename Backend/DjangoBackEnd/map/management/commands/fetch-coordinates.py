@@ -1,85 +1,181 @@
-import json
-import polyline
-import re
+import numpy as np
+import orjson
 import os
-from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
-from django.core.management.base import BaseCommand
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from map.utils import decode_polyline
 
 OUTPUT_DIRECTORY = settings.BASE_DIR / "data"
 JSON_FILE_PATH = OUTPUT_DIRECTORY / "route_coordinates.geojson"
 
+GRAPHQL_URL = "https://api.entur.io/realtime/v2/vehicles/graphql"
+HEADERS = {
+    "ET-Client-Name": "troms-fylkeskommune-studenter",
+}
+CODESPACE_ID = "TRO"
+# Number of per-line serviceJourneys queries in flight at once
+MAX_CONCURRENT_QUERIES = 8
+REQUEST_TIMEOUT = 30  # seconds
+
+LINES_QUERY = """
+query ($codespaceId: String!) {
+  lines(codespaceId: $codespaceId) {
+    lineRef
+  }
+}
+"""
+
+SERVICE_JOURNEYS_QUERY = """
+query ($lineRef: String!) {
+  serviceJourneys(lineRef: $lineRef) {
+    id
+    pointsOnLink {
+      length
+      points
+    }
+  }
+}
+"""
+
+def extract_route_id(journey_id):
+    """
+    Return the digits between a ':' and the following '_' of a journey id
+    (e.g. "TRO:ServiceJourney:1234_..." -> "1234"), or None.
+    Same result as re.search(r":(\d+)_", journey_id) using plain str.find().
+    """
+    colon = journey_id.find(":")
+    while colon != -1:
+        underscore = journey_id.find("_", colon + 1)
+        if underscore == -1:
+            return None
+        candidate = journey_id[colon + 1:underscore]
+        if candidate.isdecimal():
+            return candidate
+        colon = journey_id.find(":", colon + 1)
+    return None
+
 class Command(BaseCommand):
     help = "Fetch static bus route coordinates for all bus lines in Troms"
 
-    def fetch_route_coordinates(self):
-        uri = "https://api.entur.io/realtime/v2/vehicles/graphql"
-
-        headers = {
-            "ET-Client-Name": "troms-fylkeskommune-studenter",
-        }
-
-        route_query = gql("""
-        query {
-          serviceJourneys(codespaceId: "TRO") {
-            id
-            pointsOnLink {
-              length
-              points
+    def post_query(self, session, query, variables):
+        """Run one GraphQL query and return its "data" object."""
+        try:
+            response = session.post(
+                GRAPHQL_URL, json={"query": query, "variables": variables}, timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+            payload = orjson.loads(response.content)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            raise CommandError(f"GraphQL request failed: {e}")
+        if payload.get("errors"):
+            raise CommandError(f"GraphQL errors: {payload['errors']}")
+        return payload.get("data") or {}
+
+    def fetch_service_journeys(self, session, line_ref):
+        """
+        Fetch the service journeys of one line. A per-line response is small and is
+        decoded whole in the pool thread, with orjson, while the other lines download.
+        """
+        try:
+            data = self.post_query(session, SERVICE_JOURNEYS_QUERY, {"lineRef": line_ref})
+        except CommandError as e:
+            raise CommandError(f"Line {line_ref}: {e}")
+        return data.get("serviceJourneys") or []
+
+    def iter_service_journeys(self):
+        """Yield service journeys line by line as the per-line responses arrive."""
+        # Query journeys line by line instead of one serviceJourneys(codespaceId) mega-query,
+        # so each response (and the server-side work behind it) stays small.
+        with requests.Session() as session:
+            session.headers.update(HEADERS)
+            lines = self.post_query(session, LINES_QUERY, {"codespaceId": CODESPACE_ID}).get("lines") or []
+        line_refs = [line["lineRef"] for line in lines if line.get("lineRef")]
+        self.stdout.write(f"Fetching service journeys for {len(line_refs)} lines...")
+
+        # requests.Session is not thread-safe, so each pool thread keeps its own
+        # session (and connection) for all the lines it fetches
+        thread_local = threading.local()
+        sessions = []
+
+        def fetch_line(line_ref):
+            session = getattr(thread_local, "session", None)
+            if session is None:
+                session = thread_local.session = requests.Session()
+                session.headers.update(HEADERS)
+                sessions.append(session)
+            return self.fetch_service_journeys(session, line_ref)
+
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES) as executor:
+                for journeys in executor.map(fetch_line, line_refs):
+                    yield from journeys
+        finally:
+            for session in sessions:
+                session.close()
+
+    def iter_features(self, service_journeys):
+        """Yield one GeoJSON LineString feature per service journey that has points and a route ID."""
+        for route_data in service_journeys:
+            points_on_link = route_data.get("pointsOnLink", None)
+
+            # Check if pointsOnLink is None or doesn't contain points
+            if not (points_on_link and points_on_link.get("points")):
+                # Handle the case where no points are available for this route
+                self.stdout.write(self.style.WARNING(f"No points data found for journey ID {route_data.get('id')}"))
+                continue
+
+            # Extract the desired part of the ID (the part after ':' and before '_')
+            trimmed_id = extract_route_id(route_data.get("id") or "")
+            if not trimmed_id:
+                self.stdout.write(self.style.WARNING(f"Could not extract route ID for journey {route_data.get('id')}"))
+                continue
+
+            decoded_coordinates = decode_polyline(points_on_link["points"])
+            # Create a feature for the bus route
+            yield {
+                "type": "Feature",
+                "geometry": {
+                    "type": "LineString",
+                    # Ensure [longitude, latitude] order; orjson serializes the contiguous array directly
+                    "coordinates": np.ascontiguousarray(decoded_coordinates[:, ::-1]),
+                },
+                "properties": {
+                    "route_id": trimmed_id  # Add the trimmed ID to the properties
+                }
             }
-          }
-        }
-        """)
-
-        transport = RequestsHTTPTransport(url=uri, headers=headers)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        result = client.execute(route_query)
-        print(f"Received data: {result}")
-
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-
-        if "serviceJourneys" in result and result["serviceJourneys"]:
-            for route_data in result["serviceJourneys"]:
-                points_on_link = route_data.get("pointsOnLink", None)
-
-                # Check if pointsOnLink is None or doesn't contain points
-                if points_on_link and points_on_link.get("points"):
-                    encoded_points = points_on_link["points"]
-                    decoded_coordinates = polyline.decode(encoded_points)
-
-                    # Extract the desired part of the ID using regex
-                    match = re.search(r":(\d+)_", route_data.get("id", ""))
-                    if match:
-                        trimmed_id = match.group(0)[1:-1]  # Get the part after ':' and before '_'
-
-                        # Create a feature for the bus route
-                        feature = {
-                            "type": "Feature",
-                            "geometry": {
-                                "type": "LineString",
-                                "coordinates": [[lon, lat] for lat, lon in decoded_coordinates]  # Ensure [longitude, latitude] order
-                            },
-                            "properties": {
-                                "route_id": trimmed_id  # Add the trimmed ID to the properties
-                            }
-                        }
-
-                        geojson_data["features"].append(feature)
-                    else:
-                        self.stdout.write(self.style.WARNING(f"Could not extract route ID for journey {route_data.get('id')}"))
-                else:
-                    # Handle the case where no points are available for this route
-                    self.stdout.write(self.style.WARNING(f"No points data found for journey ID {route_data.get('id')}"))
-
-            # Save all routes to a GeoJSON file
-            with open(JSON_FILE_PATH, "w") as f:
-                json.dump(geojson_data, f, indent=4)
 
+    def write_feature_collection(self, features, path):
+        """
+        Stream features into a GeoJSON FeatureCollection file, serializing one feature
+        at a time so the whole collection is never held in memory.
+        Writes to a temporary file that only replaces `path` once at least one feature
+        was written. Returns the number of features written.
+        """
+        tmp_path = f"{path}.tmp"
+        count = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b'{"type":"FeatureCollection","features":[')
+                for feature in features:
+                    if count:
+                        f.write(b",")
+                    f.write(orjson.dumps(feature, option=orjson.OPT_SERIALIZE_NUMPY))
+                    count += 1
+                f.write(b"]}")
+            if count:
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return count
+
+    def fetch_route_coordinates(self):
+        features = self.iter_features(self.iter_service_journeys())
+        # Save all routes to a GeoJSON file
+        if self.write_feature_collection(features, JSON_FILE_PATH):
             self.stdout.write(self.style.SUCCESS("Successfully fetched and saved all route coordinates as GeoJSON"))
         else:
             self.stdout.write(self.style.ERROR("No route data found for any bus line in Troms"))
@@ -1,16 +1,23 @@
+import io
 import os
+from functools import lru_cache
 import logging
+import numpy as np
 import requests
 import django
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from dateutil.parser import isoparse
 from datetime import timezone as dt_timezone
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import transaction
 # --- GeoDjango Imports ---
-from django.contrib.gis.geos import Point, LineString
+from django.contrib.gis.geos import GEOSException
 from django.core.exceptions import ValidationError
 # --- End GeoDjango Imports ---
 from map.models import VtsSituation, ApiMetadata
+from map.utils import linestring_from_array, point_from_xy
 from config import UserName_DATEX, Password_DATEX
 from email.utils import format_datetime
 
@@ -21,17 +28,104 @@ django.setup()
 BaseURL = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata/"
 logger = logging.getLogger(__name__)
 
-# Define namespaces (assuming these remain correct)
+# Shared HTTP session: keeps the TLS connection alive between polls made from the same
+# process (e.g. run_cron) and asks for a compressed payload.
+_SESSION = requests.Session()
+_SESSION.auth = (UserName_DATEX, Password_DATEX)
+_SESSION.headers['Accept-Encoding'] = 'gzip, deflate'
+
+# Define namespaces, one prefix per URI
 namespaces = {
-    'ns0': 'http://datex2.eu/schema/3/messageContainer',
     'ns2': 'http://datex2.eu/schema/3/messageContainer',
     'ns12': 'http://datex2.eu/schema/3/situation',
     'ns8': 'http://datex2.eu/schema/3/locationReferencing',
     'common': 'http://datex2.eu/schema/3/common',
     'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-    'def': 'http://datex2.eu/schema/3/common',
 }
 
+# Columns refreshed when an incoming situation already exists (everything but the key)
+UPSERT_FIELDS = [
+    'version', 'creation_time', 'version_time', 'probability_of_occurrence', 'severity',
+    'source_country', 'source_identification', 'source_name', 'source_type',
+    'validity_status', 'overall_start_time', 'overall_end_time', 'location', 'path',
+    'location_description', 'road_number', 'area_name', 'transit_service_information',
+    'transit_service_type', 'pos_list_raw', 'comment', 'filter_used',
+]
+UPSERT_BATCH_SIZE = 500
+
+LAST_MODIFIED_KEY = ApiMetadata.LAST_MODIFIED_KEY
+# ApiMetadata values read or written by this process. The row only changes when this
+# command stores a new Last-Modified date, so repeated polls (e.g. from run_cron) skip the SELECT.
+_METADATA_CACHE = {}
+
+# Fully qualified tag of the records streamed out of the DATEX payload
+SITUATION_RECORD_TAG = f"{{{namespaces['ns12']}}}situationRecord"
+# Payload publication time, used as the Last-Modified fallback
+PUBLICATION_TIME_TAG = f"{{{namespaces['common']}}}publicationTime"
+# Fully qualified tags of the containers looked up in every record, resolved once here
+# so find() compares tags directly instead of expanding prefixes on each call
+GENERAL_PUBLIC_COMMENT_TAG = f"{{{namespaces['ns12']}}}generalPublicComment"
+SOURCE_TAG = f"{{{namespaces['ns12']}}}source"
+VALIDITY_TAG = f"{{{namespaces['ns12']}}}validity"
+LOCATION_REFERENCE_TAG = f"{{{namespaces['ns12']}}}locationReference"
+AREA_NAME_TAG = f"{{{namespaces['ns8']}}}areaName"
+GML_LINE_STRING_TAG = f"{{{namespaces['ns8']}}}gmlLineString"
+XSI_TYPE_ATTRIBUTE = f"{{{namespaces['xsi']}}}type"
+
+
+@lru_cache(maxsize=1024)
+def _parse_datetime_utc(datetime_str):
+    """
+    Parse an ISO 8601 string into a UTC datetime. Cached because DATEX payloads repeat
+    the same publication/validity timestamps across many records.
+    """
+    parsed_datetime = isoparse(datetime_str)
+    if parsed_datetime.tzinfo is not dt_timezone.utc:
+        parsed_datetime = parsed_datetime.astimezone(dt_timezone.utc)
+    return parsed_datetime
+
+
+def _xpath(path):
+    """Compile a text-extracting XPath once, bound to the DATEX namespaces."""
+    # smart_strings=False returns plain str results that don't keep the parsed record alive
+    return ET.XPath(path, namespaces=namespaces, smart_strings=False)
+
+
+def _first_text(xpath, element):
+    """Evaluate a compiled text() XPath and return the first result or None, like findtext()."""
+    result = xpath(element)
+    return result[0] if result else None
+
+
+# Precompiled lookups, evaluated for every situation record.
+# Relative to the situationRecord element:
+CREATION_TIME_XPATH = _xpath("ns12:situationRecordCreationTime/text()")
+VERSION_TIME_XPATH = _xpath("ns12:situationRecordVersionTime/text()")
+PROBABILITY_XPATH = _xpath("ns12:probabilityOfOccurrence/text()")
+SEVERITY_XPATH = _xpath("ns12:severity/text()")
+TRANSIT_SERVICE_INFORMATION_XPATH = _xpath("ns12:transitServiceInformation/text()")
+TRANSIT_SERVICE_TYPE_XPATH = _xpath("ns12:transitServiceType/text()")
+# Relative to ns12:generalPublicComment:
+COMMENT_VALUES_XPATH = _xpath(".//common:value/text()")
+# Relative to ns12:source:
+SOURCE_COUNTRY_XPATH = _xpath("common:sourceCountry/text()")
+SOURCE_IDENTIFICATION_XPATH = _xpath("common:sourceIdentification/text()")
+SOURCE_NAME_XPATH = _xpath("common:sourceName/common:values/common:value/text()")
+SOURCE_TYPE_XPATH = _xpath("common:sourceType/text()")
+# Relative to ns12:validity:
+VALIDITY_STATUS_XPATH = _xpath("common:validityStatus/text()")
+OVERALL_START_TIME_XPATH = _xpath("common:validityTimeSpecification/common:overallStartTime/text()")
+OVERALL_END_TIME_XPATH = _xpath("common:validityTimeSpecification/common:overallEndTime/text()")
+# Relative to ns12:locationReference:
+LATITUDE_XPATH = _xpath(".//ns8:latitude/text()")
+LONGITUDE_XPATH = _xpath(".//ns8:longitude/text()")
+LOCATION_DESCRIPTION_XPATH = _xpath(".//ns8:locationDescription/common:values/common:value/text()")
+ROAD_NUMBER_XPATH = _xpath(".//ns8:roadInformation/ns8:roadNumber/text()")
+# Relative to ns8:areaName:
+AREA_NAME_VALUES_XPATH = _xpath("common:values/common:value/text()")
+# Relative to ns8:gmlLineString:
+POS_LIST_XPATH = _xpath("ns8:posList/text()")
+
 # Docstring remains largely the same, but mention GeoDjango usage
 """
 This script is a Django management command that fetches transit situation data from the VTS (Vegtrafikksentralen) API,
@@ -56,91 +150,131 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         # Retrieve the last modified date (same as before)
-        last_modified_entry = ApiMetadata.objects.filter(key='last_modified_date').first()
+        last_modified_date = _METADATA_CACHE.get(LAST_MODIFIED_KEY)
+        if last_modified_date is None:
+            last_modified_date = ApiMetadata.objects.filter(key=LAST_MODIFIED_KEY).values_list('value', flat=True).first()
+            if last_modified_date:
+                _METADATA_CACHE[LAST_MODIFIED_KEY] = last_modified_date
         headers = {}
-        if last_modified_entry:
-            last_modified_date = last_modified_entry.value
+        if last_modified_date:
             headers['If-Modified-Since'] = last_modified_date
             logger.info(f"Using If-Modified-Since header: {last_modified_date}")
 
         url = BaseURL # Removed f-string as no variable is used here
         try:
-            response = requests.get(url, auth=(UserName_DATEX, Password_DATEX), headers=headers)
+            # Streamed: the body is parsed while it is read instead of being buffered first
+            response = _SESSION.get(url, headers=headers, stream=True)
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         except requests.RequestException as e:
             logger.error(f"HTTP request failed: {e}")
             return
 
-        # Only process if status code was 200
-        if response.status_code == 200:
-             logger.info("Received new data (HTTP 200). Processing...")
-             self.process_response(response)
-             self.update_last_modified_date(response) # Update last modified only on successful fetch
-        # The 304 case is handled by the HTTPError exception check above.
+        try:
+            # Only process if status code was 200
+            if response.status_code == 200:
+                logger.info("Received new data (HTTP 200). Processing...")
+                response.raw.decode_content = True # The session asks for gzip; urllib3 inflates it
+                try:
+                    publication_time_str = self.process_response(response)
+                except (ET.ParseError, Urllib3HTTPError) as e: # Malformed payload, or the body stream broke off
+                    # process_response rolled back; keep the old date so the payload is fetched again
+                    logger.error(f"Could not read the VTS payload, nothing stored: {e}")
+                    return
+                # Update last modified only on successful fetch
+                self.update_last_modified_date(response.headers.get('Last-Modified'), publication_time_str)
+            # The 304 case is handled by the HTTPError exception check above.
+        finally:
+            response.close() # Release the streamed connection back to the session's pool
 
     # Removed to_float as direct conversion happens during Point creation
 
     def safe_parse_datetime(self, datetime_str):
-        # (same as before)
         if datetime_str is None:
             return None
         try:
-            parsed_datetime = isoparse(datetime_str)
-            parsed_datetime = parsed_datetime.astimezone(dt_timezone.utc)
-            return parsed_datetime
+            return _parse_datetime_utc(datetime_str)
         except (ValueError, TypeError) as e:
             logger.error(f"Could not parse datetime '{datetime_str}': {e}")
             return None
 
+    def iter_situation_records(self, source):
+        """
+        Stream situationRecord (and publicationTime) elements out of the XML payload,
+        read from the file-like `source`.
+
+        Uses lxml's iterparse so only one record is materialized at a time: once the
+        caller is done with a record it is cleared and detached from its parent,
+        keeping memory bounded regardless of the payload size.
+        A malformed or truncated payload raises ET.ParseError (after the records before
+        the error were yielded), so the caller can discard the partial result.
+        """
+        tags = (SITUATION_RECORD_TAG, PUBLICATION_TIME_TAG)
+        for _, record in ET.iterparse(source, events=("end",), tag=tags):
+            yield record
+            record.clear()
+            while record.getprevious() is not None:
+                del record.getparent()[0]
+
+    @transaction.atomic
     def process_response(self, response):
-        """Parse the XML response, process situation records, create geometry objects, and update the database."""
-        # Optional: Save debug response (same as before)
-        with open("debug_response.xml", "w", encoding="utf-8") as f:
-            f.write(response.content.decode('utf-8'))
-        try:
-            root = ET.fromstring(response.content)
-        except ET.ParseError as e:
-            logger.error(f"Error parsing XML: {e}")
-            return
+        """
+        Parse the XML response, process situation records, create geometry objects, and update the database.
+        Returns the payload's publicationTime text (or None), picked up during the same parse.
+        The body is parsed from response.raw as it streams in. A parse error propagates
+        and rolls back everything stored from the payload.
+        """
+        source = response.raw
+        # Optional: Save debug response while developing (opt in with VTS_DUMP_XML=1)
+        if settings.DEBUG and os.environ.get('VTS_DUMP_XML'):
+            content = source.read()
+            with open("debug_response.xml", "wb") as f:
+                f.write(content)
+            source = io.BytesIO(content)
 
         processed_count = 0
         skipped_count = 0
+        situations_by_id = {}
+        publication_time_str = None
+
+        # Iterate over each situation record as it is parsed
+        for situation in self.iter_situation_records(source):
+            if situation.tag == PUBLICATION_TIME_TAG:
+                if publication_time_str is None: # Keep the first one in document order
+                    publication_time_str = situation.text
+                continue
 
-        # Iterate over each situation record
-        for situation in root.findall(".//ns12:situationRecord", namespaces):
             situation_id = situation.get("id") # Get ID early for logging errors
             try:
                 # Extract comment (same as before)
                 comment = None
-                general_public_comment = situation.find("ns12:generalPublicComment", namespaces=namespaces)
+                general_public_comment = situation.find(GENERAL_PUBLIC_COMMENT_TAG)
                 if general_public_comment is not None:
-                    comment_values = general_public_comment.findall(".//common:value", namespaces=namespaces)
-                    comments = [cv.text for cv in comment_values if cv.text]
+                    comments = [text for text in COMMENT_VALUES_XPATH(general_public_comment) if text]
                     comment = ' '.join(comments) if comments else None
 
                 # Extract xsi:type (same as before)
-                xsi_type = situation.attrib.get('{http://www.w3.org/2001/XMLSchema-instance}type')
+                xsi_type = situation.get(XSI_TYPE_ATTRIBUTE)
                 situation_type = xsi_type.split(':')[-1] if xsi_type else 'Unknown'
 
                 # Extract basic information (same as before)
                 version = situation.get("version")
-                creation_time = self.safe_parse_datetime(situation.findtext("ns12:situationRecordCreationTime", namespaces=namespaces))
-                version_time = self.safe_parse_datetime(situation.findtext("ns12:situationRecordVersionTime", namespaces=namespaces))
-                probability_of_occurrence = situation.findtext("ns12:probabilityOfOccurrence", namespaces=namespaces)
-                severity = situation.findtext("ns12:severity", namespaces=namespaces)
+                creation_time = self.safe_parse_datetime(_first_text(CREATION_TIME_XPATH, situation))
+                version_time = self.safe_parse_datetime(_first_text(VERSION_TIME_XPATH, situation))
+                probability_of_occurrence = _first_text(PROBABILITY_XPATH, situation)
+                severity = _first_text(SEVERITY_XPATH, situation)
 
                 # Extract source information (same as before)
-                source = situation.find("ns12:source", namespaces=namespaces)
-                source_country = source.findtext("common:sourceCountry", namespaces=namespaces) if source is not None else None
-                source_identification = source.findtext("common:sourceIdentification", namespaces=namespaces) if source is not None else None
-                source_name = source.findtext("common:sourceName/common:values/common:value", namespaces=namespaces) if source is not None else None
-                source_type = source.findtext("common:sourceType", namespaces=namespaces) if source is not None else None
+                source = situation.find(SOURCE_TAG)
+                source_country = _first_text(SOURCE_COUNTRY_XPATH, source) if source is not None else None
+                source_identification = _first_text(SOURCE_IDENTIFICATION_XPATH, source) if source is not None else None
+                source_name = _first_text(SOURCE_NAME_XPATH, source) if source is not None else None
+                source_type = _first_text(SOURCE_TYPE_XPATH, source) if source is not None else None
 
                 # Extract validity information (same as before)
-                validity = situation.find("ns12:validity", namespaces=namespaces)
-                validity_status = validity.findtext("common:validityStatus", namespaces=namespaces) if validity is not None else None
-                overall_start_time = self.safe_parse_datetime(validity.findtext("common:validityTimeSpecification/common:overallStartTime", namespaces=namespaces)) if validity is not None else None
-                overall_end_time = self.safe_parse_datetime(validity.findtext("common:validityTimeSpecification/common:overallEndTime", namespaces=namespaces)) if validity is not None else None
+                validity = situation.find(VALIDITY_TAG)
+                validity_status = _first_text(VALIDITY_STATUS_XPATH, validity) if validity is not None else None
+                overall_start_time = self.safe_parse_datetime(_first_text(OVERALL_START_TIME_XPATH, validity)) if validity is not None else None
+                overall_end_time = self.safe_parse_datetime(_first_text(OVERALL_END_TIME_XPATH, validity)) if validity is not None else None
 
                 # --- Process Location and Geometry ---
                 point_location = None
@@ -150,86 +284,87 @@ class Command(BaseCommand):
                 area_name = None
                 pos_list_raw = None # Keep for reference
 
-                location_reference = situation.find("ns12:locationReference", namespaces=namespaces)
+                location_reference = situation.find(LOCATION_REFERENCE_TAG)
                 if location_reference is not None:
                     # Extract Lat/Lon for Point
-                    latitude_str = location_reference.findtext(".//ns8:latitude", namespaces=namespaces)
-                    longitude_str = location_reference.findtext(".//ns8:longitude", namespaces=namespaces)
+                    latitude_str = _first_text(LATITUDE_XPATH, location_reference)
+                    longitude_str = _first_text(LONGITUDE_XPATH, location_reference)
                     if latitude_str and longitude_str:
                         try:
                             lat = float(latitude_str)
                             lon = float(longitude_str)
                             # Create Point(x, y) -> Point(longitude, latitude) with SRID 4326
-                            point_location = Point(lon, lat, srid=4326)
+                            point_location = point_from_xy(lon, lat, srid=4326)
                         except (ValueError, TypeError) as e:
                             logger.warning(f"Invalid coordinates for situation {situation_id}: lat='{latitude_str}', lon='{longitude_str}'. Error: {e}")
                             point_location = None # Ensure it's None if conversion fails
 
                     # Extract other location info
-                    location_description = location_reference.findtext(".//ns8:locationDescription/common:values/common:value", namespaces=namespaces)
-                    road_number = location_reference.findtext(".//ns8:roadInformation/ns8:roadNumber", namespaces=namespaces)
-                    area_name_element = location_reference.find(".//ns8:areaName", namespaces=namespaces)
+                    location_description = _first_text(LOCATION_DESCRIPTION_XPATH, location_reference)
+                    road_number = _first_text(ROAD_NUMBER_XPATH, location_reference)
+                    area_name_element = next(location_reference.iterdescendants(AREA_NAME_TAG), None)
                     area_name = None
                     if area_name_element is not None:
-                        area_name_values = area_name_element.findall("common:values/common:value", namespaces=namespaces)
-                        area_name_texts = [v.text for v in area_name_values if v.text]
+                        area_name_texts = [text for text in AREA_NAME_VALUES_XPATH(area_name_element) if text]
                         area_name = ' '.join(area_name_texts) if area_name_texts else None
 
                     # Extract posList data for LineString
-                    gml_line_string = location_reference.find(".//ns8:gmlLineString", namespaces=namespaces)
+                    gml_line_string = next(location_reference.iterdescendants(GML_LINE_STRING_TAG), None)
                     if gml_line_string is not None:
-                        pos_list_raw = gml_line_string.findtext("ns8:posList", namespaces=namespaces)
+                        pos_list_raw = _first_text(POS_LIST_XPATH, gml_line_string)
                         if pos_list_raw:
                             try:
-                                # Parse the posList into coordinate pairs (lat lon lat lon...)
-                                coords_flat = list(map(float, pos_list_raw.strip().split()))
+                                # Parse the posList into coordinate pairs (lat lon lat lon...) in one numpy conversion
+                                coords_flat = np.array(pos_list_raw.split(), dtype=np.float64)
                                 # Ensure even number of coordinates
                                 if len(coords_flat) % 2 == 0 and len(coords_flat) >= 4: # Need at least 2 points for a line
-                                    # Create list of (lon, lat) tuples for LineString
-                                    positions_lon_lat = list(zip(coords_flat[1::2], coords_flat[::2])) # lon is second, lat is first in each pair
-                                    # Create LineString object with SRID 4326
-                                    line_path = LineString(positions_lon_lat, srid=4326)
+                                    # Swap each (lat, lon) pair to (lon, lat) and pack the LineString as WKB with SRID 4326
+                                    line_path = linestring_from_array(coords_flat.reshape(-1, 2)[:, ::-1], srid=4326)
                                 else:
                                      logger.warning(f"Invalid number of coordinates ({len(coords_flat)}) in posList for situation {situation_id}. Minimum 4 required.")
                                      line_path = None
                             except (ValueError, TypeError) as e:
                                 logger.warning(f"Could not parse posList '{pos_list_raw[:50]}...' for situation {situation_id}: {e}")
                                 line_path = None
-                            except ValidationError as e: # Catch potential LineString validation errors
+                            except (ValidationError, GEOSException) as e: # Catch potential LineString validation errors
                                 logger.warning(f"Could not create LineString for situation {situation_id} from posList '{pos_list_raw[:50]}...': {e}")
                                 line_path = None
 
                 # Extract transit service information (same as before)
-                transit_service_information = situation.findtext("ns12:transitServiceInformation", namespaces=namespaces)
-                transit_service_type = situation.findtext("ns12:transitServiceType", namespaces=namespaces)
-
-                # --- Create and save the VtsSituation object ---
-                VtsSituation.objects.update_or_create(
+                transit_service_information = _first_text(TRANSIT_SERVICE_INFORMATION_XPATH, situation)
+                transit_service_type = _first_text(TRANSIT_SERVICE_TYPE_XPATH, situation)
+
+                # --- Queue the VtsSituation object for the batched upsert ---
+                # Required columns: a missing value would fail the whole batch insert
+                if not situation_id or not version or creation_time is None:
+                    logger.warning(f"Skipping situation record {situation_id}: missing id, version or creation time.")
+                    skipped_count += 1
+                    continue
+                # Later records with the same ID win, matching the previous update_or_create behaviour
+                situations_by_id[situation_id] = VtsSituation(
                     situation_id=situation_id,
-                    defaults={
-                        'version': version,
-                        'creation_time': creation_time,
-                        'version_time': version_time,
-                        'probability_of_occurrence': probability_of_occurrence,
-                        'severity': severity,
-                        'source_country': source_country,
-                        'source_identification': source_identification,
-                        'source_name': source_name,
-                        'source_type': source_type,
-                        'validity_status': validity_status,
-                        'overall_start_time': overall_start_time,
-                        'overall_end_time': overall_end_time,
-                        'location': point_location,
-                        'path': line_path,
-                        'location_description': location_description,
-                        'road_number': road_number,
-                        'area_name': area_name,
-                        'transit_service_information': transit_service_information,
-                        'transit_service_type': transit_service_type,
-                        'pos_list_raw': pos_list_raw, # Store raw string for reference
-                        'comment': comment,
-                        'filter_used': situation_type,
-                    }
+                    version=version,
+                    creation_time=creation_time,
+                    version_time=version_time,
+                    probability_of_occurrence=probability_of_occurrence,
+                    severity=severity,
+                    source_country=source_country,
+                    source_identification=source_identification,
+                    source_name=source_name,
+                    source_type=source_type,
+                    validity_status=validity_status,
+                    overall_start_time=overall_start_time,
+                    overall_end_time=overall_end_time,
+                    location=point_location,
+                    path=line_path,
+                    location_description=location_description,
+                    road_number=road_number,
+                    area_name=area_name,
+                    transit_service_information=transit_service_information,
+                    transit_service_type=transit_service_type,
+                    pos_list_raw=pos_list_raw, # Store raw string for reference
+                    comment=comment,
+                    filter_used=situation_type,
                 )
                 processed_count += 1
                 # Update log message
@@ -249,14 +384,27 @@ class Command(BaseCommand):
                 logger.exception(f"FATAL Error processing situation record ID {situation_id}: {e}")
                 skipped_count += 1
 
+        # --- Upsert all situations in batched INSERT ... ON CONFLICT statements ---
+        if situations_by_id:
+            VtsSituation.objects.bulk_create(
+                situations_by_id.values(),
+                update_conflicts=True,
+                unique_fields=['situation_id'],
+                update_fields=UPSERT_FIELDS,
+                batch_size=UPSERT_BATCH_SIZE,
+            )
+            logger.info(f"Upserted {len(situations_by_id)} situations in the database.")
+
         logger.info(f"Finished processing. Processed: {processed_count}, Skipped due to errors: {skipped_count}")
+        return publication_time_str
 
 
-    def update_last_modified_date(self, response):
-        """Update the last modified date in the database (same logic as before)."""
+    def update_last_modified_date(self, last_modified, publication_time_str=None):
+        """
+        Update the last modified date in the database from the Last-Modified header,
+        falling back to the publicationTime already extracted by process_response.
+        """
         try:
-            # Get the Last-Modified header from the response
-            last_modified = response.headers.get('Last-Modified')
             last_modified_date_to_save = None # Initialize
 
             if last_modified:
@@ -265,13 +413,8 @@ class Command(BaseCommand):
                 last_modified_date_to_save = last_modified
             else:
                 logger.warning("No Last-Modified header found. Attempting to use publicationTime from XML.")
-                # Attempt to extract publicationTime from the XML
+                # Use the publicationTime picked up while the payload was parsed
                 try:
-                    root = ET.fromstring(response.content)
-                    publication_time_str = root.findtext('.//def:publicationTime', namespaces=namespaces) # Simplified path might work
-                    if not publication_time_str: # Try original path if simplified fails
-                         publication_time_str = root.findtext('./ns2:payload/def:publicationTime', namespaces=namespaces)
-
                     if publication_time_str:
                         logger.debug(f"Extracted publicationTime: {publication_time_str}")
                         parsed_publication_time = self.safe_parse_datetime(publication_time_str)
@@ -284,18 +427,20 @@ class Command(BaseCommand):
                             logger.warning("Could not parse publicationTime from XML.")
                     else:
                         logger.warning("publicationTime not found in XML.")
-                except ET.ParseError as e:
-                     logger.error(f"Error parsing XML while looking for publicationTime: {e}")
                 except Exception as e: # Catch other potential errors during fallback
                      logger.error(f"Error processing publicationTime fallback: {e}")
 
 
             # Save the last modified date if we found one
             if last_modified_date_to_save:
-                ApiMetadata.objects.update_or_create(
-                    key='last_modified_date',
-                    defaults={'value': last_modified_date_to_save}
+                # Single INSERT ... ON CONFLICT(key) DO UPDATE instead of update_or_create's SELECT + UPDATE
+                ApiMetadata.objects.bulk_create(
+                    [ApiMetadata(key=LAST_MODIFIED_KEY, value=last_modified_date_to_save)],
+                    update_conflicts=True,
+                    unique_fields=['key'],
+                    update_fields=['value'],
                 )
+                _METADATA_CACHE[LAST_MODIFIED_KEY] = last_modified_date_to_save
                 logger.info(f"Last modified date updated in database: {last_modified_date_to_save}")
             else:
                 logger.error("Could not determine Last-Modified date from headers or XML. Database record not updated.")
@@ -1,8 +1,9 @@
 import requests
 import json
+import orjson
 from django.core.management.base import BaseCommand
 from django.conf import settings
-import polyline
+from map.utils import ENTUR_JOURNEY_PLANNER_URL, ENTUR_REQUEST_TIMEOUT, ENTUR_SESSION, TRIP_QUERY
 
 class Command(BaseCommand):
     help = "Fetch trip information from Entur API"
@@ -17,71 +18,25 @@ class Command(BaseCommand):
         to_place = options['to_place']
         num_trips = options['num']
         
-        # Entur GraphQL API endpoint
-        url = "https://api.entur.io/journey-planner/v3/graphql"
-        
-        # Headers with client identifier
-        headers = {
-            'ET-Client-Name': 'your-app-name',
-            'Content-Type': 'application/json'
-        }
-        
-        # GraphQL query for trip information
-        query = """
-        {
-          trip(
-            from: {
-              place: "%s"
-            },
-            to: {
-              place: "%s"
-            },
-            numTripPatterns: %d
-          ) {
-            tripPatterns {
-              legs {
-                mode
-                distance
-                line {
-                  id
-                  name
-                }
-                fromPlace {
-                  name
-                  latitude
-                  longitude
-                }
-                toPlace {
-                  name
-                  latitude
-                  longitude
-                }
-                pointsOnLink {
-                  points
-                }
-              }
-            }
-          }
-        }
-        """ % (from_place, to_place, num_trips)
-        
-        # Prepare the request payload
+        # Prepare the request payload: the shared trip query, with the places sent as GraphQL variables
         payload = {
-            "query": query
+            "query": TRIP_QUERY,
+            "variables": {"from": from_place, "to": to_place, "numTripPatterns": num_trips},
         }
         
         try:
             # Make the API call
-            response = requests.post(url, json=payload, headers=headers)
+            # The shared session sends the client identifier headers
+            response = ENTUR_SESSION.post(ENTUR_JOURNEY_PLANNER_URL, json=payload, timeout=ENTUR_REQUEST_TIMEOUT)
             response.raise_for_status()  # Raise exception for HTTP errors
             
             # Process the response
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # You can save to database, print results, or return data
             self.stdout.write(self.style.SUCCESS(json.dumps(data, indent=2)))
             
         except requests.exceptions.RequestException as e:
             self.stdout.write(self.style.ERROR(f"API request failed: {e}"))
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.stdout.write(self.style.ERROR("Failed to decode JSON response"))
\ No newline at end of file
@@ -1,9 +1,13 @@
 import os
-import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone as dt_timezone
+import multiprocessing
+import django
+import ijson
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from django.contrib.gis.geos import LineString, GEOSException
+from django.contrib.gis.geos import GEOSGeometry, GEOSException
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from dateutil.parser import isoparse # For parsing ISO 8601 timestamps
@@ -11,9 +15,94 @@ from django.db import transaction, IntegrityError
 
 # Adjust the import path if your model is elsewhere
 from map.models import BusRoute
+from map.parallel import iter_chunk_results
+from map.utils import linestring_ewkb
 
 logger = logging.getLogger(__name__)
 
+# Number of routes buffered in memory before they are written with one bulk INSERT
+BULK_CREATE_BATCH_SIZE = 1000
+# Number of features handed to a worker process at a time
+FEATURE_CHUNK_SIZE = 500
+# Below this file size, starting worker processes costs more than it saves
+PARALLEL_MIN_FILE_SIZE = 5 * 1024 * 1024  # bytes
+
+
+def prepare_features(chunk, route_id_max_length, version_max_length):
+    """
+    Validate a chunk of (feature_index, feature) pairs and convert them to
+    (feature_index, row, message) tuples, where row is
+    (route_id, path EWKB bytes, version, last_updated or None) or None if the feature is skipped,
+    and message is a warning to log (or None).
+
+    Pure Python/numpy with no ORM or GEOS calls, so it can run in worker processes.
+    """
+    results = []
+    for feature_index, feature in chunk:
+        if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+            results.append((feature_index, None, f"Skipping invalid item at index {feature_index} (not a Feature object): {feature}"))
+            continue
+
+        properties = feature.get('properties', {}) or {} # Ensure properties is a dict
+        geometry = feature.get('geometry', {}) or {} # Ensure geometry is a dict
+
+        # --- Extract Geometry ---
+        geom_type = geometry.get('type')
+        coords = geometry.get('coordinates')
+
+        if geom_type != 'LineString':
+            results.append((feature_index, None, f"Skipping feature {feature_index}: Geometry type is '{geom_type}', expected 'LineString'."))
+            continue
+
+        if not coords or not isinstance(coords, list) or len(coords) < 2:
+            results.append((feature_index, None, f"Skipping feature {feature_index}: Invalid or insufficient coordinates for LineString. Coords: {coords}"))
+            continue
+        route_id_str = properties.get('route_id')
+        # Check if route_id is present (since we made it required in the model)
+        if not route_id_str:
+            results.append((feature_index, None, f"Skipping feature {feature_index}: Missing required 'route_id' in properties."))
+            continue
+        # Convert to string explicitly in case it's a number in JSON
+        route_id_str = str(route_id_str)
+        if len(route_id_str) > route_id_max_length:
+            results.append((feature_index, None, f"Skipping feature {feature_index}: route_id '{route_id_str}' exceeds {route_id_max_length} characters."))
+            continue
+        # --- Extract Properties ---
+        route_version = properties.get('version')
+        if route_version is not None:
+            # CharField value, as full_clean() would have converted it
+            route_version = str(route_version)
+            if len(route_version) > version_max_length:
+                results.append((feature_index, None, f"Skipping feature {feature_index}: version '{route_version}' exceeds {version_max_length} characters."))
+                continue
+        last_updated_str = properties.get('last_updated') # Timestamp for the data point
+
+        # --- Pack the geometry as WKB ---
+        try:
+            # Assumes coordinates are [lon, lat] as is standard in GeoJSON (WGS84)
+            path_ewkb = linestring_ewkb(coords, srid=4326)
+        except (ValueError, TypeError) as e:
+            results.append((feature_index, None, f"Skipping feature {feature_index}: Geometry error - {e}. Coordinates start: {str(coords)[:100]}..."))
+            continue
+
+        # Parse the last_updated timestamp if available, otherwise leave it to the database default (now)
+        message = None
+        update_time = None
+        if last_updated_str:
+            try:
+                parsed_time = isoparse(last_updated_str)
+                # Ensure it's timezone-aware (assume UTC if not specified)
+                if timezone.is_naive(parsed_time):
+                    update_time = timezone.make_aware(parsed_time, dt_timezone.utc)
+                else:
+                    update_time = parsed_time # Already aware
+            except (ValueError, TypeError) as ts_err:
+                message = f"Feature {feature_index}: Could not parse timestamp '{last_updated_str}'. The database sets the import time instead. Error: {ts_err}"
+
+        results.append((feature_index, (route_id_str, path_ewkb, route_version, update_time), message))
+    return results
+
+
 class Command(BaseCommand):
     help = (
         "Imports bus route shapes from a GeoJSON FeatureCollection file. "
@@ -31,9 +120,93 @@ class Command(BaseCommand):
             action='store_true',
             help='Delete all existing BusRoute entries before importing.',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes used to validate and encode features (default: CPU count, 1 = no worker processes).',
+        )
         # Optional: Add arguments for default version if not in GeoJSON
         # parser.add_argument('--default-version', type=str, help='Default version if not in properties')
 
+    def root_type(self, f):
+        """
+        Return the root object's "type" member (None if it has none) and rewind `f`.
+
+        Only the head of the file is parsed when "type" comes before "features", as it
+        normally does. Otherwise the rest of the file is scanned for it.
+        """
+        root_type = None
+        for prefix, event, value in ijson.parse(f):
+            if prefix == 'type':
+                root_type = value
+                break
+            if prefix == 'features':
+                f.seek(0)
+                root_type = next(ijson.items(f, 'type'), None)
+                break
+        f.seek(0)
+        return root_type
+
+    def iter_features(self, geojson_file_path):
+        """
+        Stream the features of a GeoJSON FeatureCollection one at a time.
+
+        Uses ijson so only a single feature is held in memory, instead of loading
+        the whole document with json.load().
+        """
+        try:
+            with open(geojson_file_path, 'rb') as f:
+                # Validate basic GeoJSON structure
+                if self.root_type(f) != 'FeatureCollection':
+                    raise ValueError("JSON root must be a GeoJSON FeatureCollection object.")
+                yield from ijson.items(f, 'features.item', use_float=True)
+        except ijson.JSONError as e:
+            raise CommandError(f"Error parsing GeoJSON file: {e}")
+        except ValueError as e:
+            raise CommandError(f"Invalid GeoJSON structure: {e}")
+        except OSError as e:
+            raise CommandError(f"Error reading file: {e}")
+
+    def iter_feature_chunks(self, geojson_file_path):
+        """Group the streamed features into lists of (feature_index, feature) pairs."""
+        chunk = []
+        for feature_index, feature in enumerate(self.iter_features(geojson_file_path), start=1):
+            chunk.append((feature_index, feature))
+            if len(chunk) >= FEATURE_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_prepared_features(self, chunks, route_id_max_length, version_max_length, workers):
+        """
+        Yield the prepare_features() results of every chunk, in file order.
+        With more than one worker the chunks are spread over a process pool, keeping
+        at most two chunks per worker in flight so the file is still streamed.
+        """
+        if workers <= 1:
+            for chunk in chunks:
+                yield from prepare_features(chunk, route_id_max_length, version_max_length)
+            return
+
+        # handle() runs inside a transaction: a forked worker would inherit its open
+        # SQLite connection, so the workers start from a fresh interpreter instead
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+        ) as executor:
+            yield from iter_chunk_results(
+                executor, prepare_features, chunks, 2 * workers, route_id_max_length, version_max_length
+            )
+
+    def save_routes(self, routes):
+        """Write a buffer of BusRoute objects with a single batched INSERT."""
+        try:
+            BusRoute.objects.bulk_create(routes, batch_size=BULK_CREATE_BATCH_SIZE)
+        except IntegrityError as e:
+            raise CommandError(f"Database integrity error while saving routes: {e}")
+        return len(routes)
+
     @transaction.atomic # Process the import within a single database transaction
     def handle(self, *args, **options):
         geojson_file_path = options['geojson_file_path']
@@ -52,118 +225,56 @@ class Command(BaseCommand):
             deleted_count, _ = BusRoute.objects.all().delete()
             self.stdout.write(f"Deleted {deleted_count} existing routes.")
 
-        # --- Read and Parse GeoJSON ---
-        try:
-            with open(geojson_file_path, 'r', encoding='utf-8') as f:
-                geojson_data = json.load(f)
-
-            # Validate basic GeoJSON structure
-            if not isinstance(geojson_data, dict) or geojson_data.get('type') != 'FeatureCollection':
-                raise ValueError("JSON root must be a GeoJSON FeatureCollection object.")
-            if 'features' not in geojson_data or not isinstance(geojson_data['features'], list):
-                 raise ValueError("FeatureCollection must contain a 'features' list.")
-
-            features = geojson_data['features'] # Get the list of features
-
-        except json.JSONDecodeError as e:
-            raise CommandError(f"Error parsing GeoJSON file: {e}")
-        except ValueError as e:
-             raise CommandError(f"Invalid GeoJSON structure: {e}")
-        except Exception as e:
-            raise CommandError(f"Error reading file: {e}")
-
-        self.stdout.write(f"Found {len(features)} features in the GeoJSON file.")
-
-        # --- Process Each Feature and Save to DB ---
+        # --- Stream, Process Each Feature and Save to DB ---
         created_count = 0
         skipped_count = 0
         feature_index = 0 # For better logging
+        routes_to_create = [] # Flushed with one batched INSERT every BULK_CREATE_BATCH_SIZE routes
+        route_id_max_length = BusRoute._meta.get_field('route_id').max_length
+        version_max_length = BusRoute._meta.get_field('version').max_length
+
+        workers = options['workers']
+        if os.path.getsize(geojson_file_path) < PARALLEL_MIN_FILE_SIZE:
+            workers = 1
 
         self.stdout.write("Processing features and creating new routes...")
-        for feature in features:
-            feature_index += 1
-            if not isinstance(feature, dict) or feature.get('type') != 'Feature':
-                logger.warning(f"Skipping invalid item at index {feature_index} (not a Feature object): {feature}")
+        prepared_features = self.iter_prepared_features(
+            self.iter_feature_chunks(geojson_file_path), route_id_max_length, version_max_length, workers
+        )
+        for feature_index, row, message in prepared_features:
+            if message:
+                logger.warning(message)
+            if row is None:
                 skipped_count += 1
                 continue
+            if len(routes_to_create) >= BULK_CREATE_BATCH_SIZE:
+                created_count += self.save_routes(routes_to_create)
+                routes_to_create = []
 
-            properties = feature.get('properties', {}) or {} # Ensure properties is a dict
-            geometry = feature.get('geometry', {}) or {} # Ensure geometry is a dict
-
-            # --- Extract Geometry ---
-            geom_type = geometry.get('type')
-            coords = geometry.get('coordinates')
-
-            if geom_type != 'LineString':
-                 logger.warning(f"Skipping feature {feature_index}: Geometry type is '{geom_type}', expected 'LineString'.")
-                 skipped_count += 1
-                 continue
-
-            if not coords or not isinstance(coords, list) or len(coords) < 2:
-                 logger.warning(f"Skipping feature {feature_index}: Invalid or insufficient coordinates for LineString. Coords: {coords}")
-                 skipped_count += 1
-                 continue
-            route_id_str = properties.get('route_id')
-            # Check if route_id is present (since we made it required in the model)
-            if not route_id_str:
-                logger.warning(f"Skipping feature {feature_index}: Missing required 'route_id' in properties.")
-                skipped_count += 1
-                continue
-            # Convert to string explicitly in case it's a number in JSON
-            route_id_str = str(route_id_str)
-            # --- Extract Properties ---
-            # Use properties.get('key', default_value)
-            route_version = properties.get('version') # Or use default_version if provided via args
-            last_updated_str = properties.get('last_updated') # Timestamp for the data point
-
-            # --- Create Geometry and Prepare Data ---
+            route_id_str, path_ewkb, route_version, update_time = row
             try:
-                # Create the LineString geometry object
-                # Assumes coordinates are [lon, lat] as is standard in GeoJSON
-                route_path = LineString(coords, srid=4326) # GeoJSON uses WGS84
-
-                # Parse the last_updated timestamp if available, otherwise use current time
-                update_time = timezone.now() # Default to now
-                if last_updated_str:
-                    try:
-                        parsed_time = isoparse(last_updated_str)
-                        # Ensure it's timezone-aware (assume UTC if not specified, make it aware using Django settings)
-                        if timezone.is_naive(parsed_time):
-                             # Use settings.TIME_ZONE if needed, but UTC is often safer for backend storage
-                             update_time = timezone.make_aware(parsed_time, timezone.utc)
-                        else:
-                            update_time = parsed_time # Already aware
-                    except (ValueError, TypeError) as ts_err:
-                         logger.warning(f"Feature {feature_index}: Could not parse timestamp '{last_updated_str}'. Using current time. Error: {ts_err}")
-                         # Keep update_time as timezone.now()
-
-                # --- Create new BusRoute instance ---
+                # --- Queue new BusRoute instance ---
                 # Since we don't have a unique key other than PK, we create a new entry for each feature.
-                new_route = BusRoute(
+                # The geometry was already validated when its WKB was packed, and the
+                # route_id/version lengths in prepare_features(), so the per-row
+                # full_clean() is not needed.
+                route = BusRoute(
                     route_id=route_id_str,
-                    path=route_path,
+                    path=GEOSGeometry(memoryview(path_ewkb)),
                     version=route_version, # Will be None if not in properties or defaulted
-                    last_updated=update_time,
                 )
-                new_route.full_clean() # Run model validation
-                new_route.save() # Save to database
-
-                created_count += 1
-                # self.stdout.write(f"Created route: {new_route.pk}") # Can be noisy
-
+                if update_time is not None:
+                    route.last_updated = update_time # Otherwise the column's db_default (now) applies
+                routes_to_create.append(route)
             except (ValidationError, GEOSException) as e:
-                logger.error(f"Skipping feature {feature_index}: Validation or Geometry error - {e}. Coordinates start: {str(coords)[:100]}...")
-                skipped_count += 1
-            except IntegrityError as e:
-                 # Specifically catch IntegrityError, likely due to duplicate unique route_id
-                 logger.error(f"Skipping feature {feature_index} (Route ID: {route_id_str}): Database integrity error (likely duplicate route_id) - {e}")
-                 skipped_count += 1
-            except Exception as e:
-                # Catch other unexpected errors during processing/saving a single feature
-                logger.exception(f"Skipping feature {feature_index}: Unexpected error - {e}") # Use logger.exception to include traceback
+                logger.error(f"Skipping feature {feature_index}: Validation or Geometry error - {e}.")
                 skipped_count += 1
 
+        # --- Save the remaining buffered routes ---
+        if routes_to_create:
+            created_count += self.save_routes(routes_to_create)
+
         # --- Final Report ---
         self.stdout.write(self.style.SUCCESS(
-            f"Import finished. Created: {created_count}, Skipped: {skipped_count}"
+            f"Import finished. Features read: {feature_index}, Created: {created_count}, Skipped: {skipped_count}"
         ))
\ No newline at end of file
@@ -8,12 +8,19 @@ is disseminated in near real-time to subscribers interested
 in specific routes, severities, or filters.
 """
 
+import atexit
 import time
-import json
 import logging
+import socket
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import django
+import orjson
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 from map.models import DetectedCollision # Assuming your model is in the 'map' app
 
 try:
@@ -24,29 +31,166 @@ except ImportError:
 
 logger = logging.getLogger(__name__) # Use Django's logging setup
 
+# Publishes are confirmed asynchronously: at most this many QoS 1 messages are in flight
+# before the publisher stops and waits for their PUBACKs.
+MAX_INFLIGHT_MESSAGES = 1000
+# Kernel send buffer requested for the broker socket, so a burst of publishes is not
+# held back waiting for the buffer to drain
+SOCKET_SEND_BUFFER_SIZE = 1 << 20 # bytes
+# Time allowed for the broker to acknowledge one slab of in-flight messages
+PUBLISH_CONFIRM_TIMEOUT = 10.0 # seconds
+# Rows fetched per keyset page while streaming unpublished collisions
+COLLISION_FETCH_CHUNK_SIZE = 500
+# IDs per UPDATE when marking collisions as published. Not the 1000 of a typical
+# Postgres slab: SQLite before 3.32 (still supported by Django 5.1) allows only 999
+# bound parameters per statement, and the UPDATE binds two more besides the IDs.
+MARK_PUBLISHED_CHUNK_SIZE = 500
+# Characters forbidden in MQTT topic segments, each mapped to '_'
+_TOPIC_TRANSLATE = str.maketrans({'+': '_', '#': '_', '/': '_'})
+
+# Connected client shared by every run in this process (e.g. repeated run_cron cycles),
+# so the TCP/MQTT handshake is paid once. Closed with --close or at interpreter exit.
+_MQTT_CLIENT = None
+
+
+def _close_shared_client():
+    """Stops and disconnects the shared MQTT client, if any."""
+    global _MQTT_CLIENT
+    client, _MQTT_CLIENT = _MQTT_CLIENT, None
+    if client is not None:
+        try:
+            client.loop_stop()
+            client.disconnect()
+        except Exception as e:
+            logger.warning("Error during MQTT disconnect: %s", e, exc_info=True)
+
+
+atexit.register(_close_shared_client)
+
+def unpublished_collision_values(queryset):
+    """
+    Streams plain dicts of just the fields the payload needs: the related fields are
+    joined in the same query (no N+1), no model instances are built, and large unused
+    columns (e.g. pos_list_raw, geometries) are never fetched.
+
+    Rows are read in keyset pages of COLLISION_FETCH_CHUNK_SIZE, each fetched completely
+    before it is yielded. No cursor stays open between pages, so the caller can mark rows
+    as published on the same connection while streaming: SQLite gives no isolation
+    between a running SELECT and UPDATEs of the index it walks.
+    """
+    queryset = queryset.order_by(
+        'detection_timestamp', 'id' # Process oldest first for chronological order
+    ).values(
+        'id', 'transit_information_id', 'bus_route_id', 'transit_lon', 'transit_lat',
+        'tolerance_meters', 'detection_timestamp',
+        'transit_information__severity', 'transit_information__filter_used',
+        'transit_information__situation_id', 'transit_information__comment',
+        'bus_route__route_id',
+    )
+    page = list(queryset[:COLLISION_FETCH_CHUNK_SIZE])
+    while page:
+        yield from page
+        if len(page) < COLLISION_FETCH_CHUNK_SIZE:
+            return
+        last = page[-1]
+        page = list(queryset.filter(
+            Q(detection_timestamp__gt=last['detection_timestamp'])
+            | Q(detection_timestamp=last['detection_timestamp'], id__gt=last['id'])
+        )[:COLLISION_FETCH_CHUNK_SIZE])
+
+
+def collision_values_for_ids(collision_ids):
+    """
+    Like unpublished_collision_values(), but for an explicit list of collision IDs,
+    queried in slabs of COLLISION_FETCH_CHUNK_SIZE IDs (below SQLite's bound-parameter limit).
+    """
+    for start in range(0, len(collision_ids), COLLISION_FETCH_CHUNK_SIZE):
+        yield from unpublished_collision_values(DetectedCollision.objects.filter(
+            published_to_mqtt=False, id__in=collision_ids[start:start + COLLISION_FETCH_CHUNK_SIZE]
+        ))
+
+
+def _mark_published(collision_ids, stats):
+    """
+    Marks broker-confirmed collisions as published, in UPDATEs of MARK_PUBLISHED_CHUNK_SIZE IDs.
+    Runs on the publisher's own connection between slabs of publishes.
+    Adds the rows updated to stats['marked']; IDs of a failed UPDATE stay
+    unpublished and are sent again next run.
+    """
+    for start in range(0, len(collision_ids), MARK_PUBLISHED_CHUNK_SIZE):
+        ids = collision_ids[start:start + MARK_PUBLISHED_CHUNK_SIZE]
+        try:
+            stats['marked'] += DetectedCollision.objects.filter(
+                id__in=ids,
+                published_to_mqtt=False # Ensure we only update those not already marked
+            ).update(published_to_mqtt=True)
+        except Exception as e:
+            logger.error("Failed to mark collisions %s as published in database: %s", ids, e, exc_info=True)
+            stats['failed'] += len(ids)
+
+
+def _publish_id_range(first_id, last_id, config):
+    """
+    Worker process entry point: publish the unpublished collisions with IDs in [first_id, last_id].
+
+    The worker does not write to the database. It returns
+    (processed_count, published_count, failure count, confirmed collision IDs), or
+    None if it could not connect; the parent marks the confirmed IDs.
+    """
+    unpublished = DetectedCollision.objects.filter(
+        published_to_mqtt=False, id__gte=first_id, id__lte=last_id
+    )
+    confirmed_ids = []
+    # Worker processes are short-lived, so their connection is closed right away
+    result = Command().publish_collisions(
+        unpublished_collision_values(unpublished), config, close=True, on_confirmed=confirmed_ids.extend
+    )
+    if result is None:
+        return None
+    processed_count, published_count, _, publish_failures = result
+    return processed_count, published_count, publish_failures, confirmed_ids
+
+
 class Command(BaseCommand):
     """
     Connects to an MQTT broker and publishes details of DetectedCollision
     objects that have not yet been marked as published.
 
     This command performs the following steps:
-    1. Checks for the availability of the 'paho-mqtt' library.
-    2. Queries the database for `DetectedCollision` records where
-       `published_to_mqtt` is False, ordering by detection time.
+    1. Checks whether any `DetectedCollision` records have
+       `published_to_mqtt` False, and stops right away if there are none.
+    2. Checks for the availability of the 'paho-mqtt' library.
     3. Connects to the MQTT broker specified in Django settings.
-    4. Iterates through the unpublished collisions.
-    5. For each collision:
+    4. Streams the unpublished collisions in keyset pages. For each collision:
        a. Constructs a JSON payload containing relevant details.
-       b. Constructs a hierarchical MQTT topic based on route, severity, and filter.
-       c. Publishes the payload to the topic.
-       d. Waits for publish confirmation from the broker.
-    6. After attempting to publish all collisions, it updates the
-       `published_to_mqtt` flag to True in the database for all collisions
-       that were successfully published and confirmed. This is done in a
-       single atomic transaction.
-    7. Disconnects from the MQTT broker.
+       b. Adds the payload to the bucket of its route, severity and filter; a new
+          bucket gets its hierarchical MQTT topic and its "common" part (those
+          three fields, serialized once).
+    5. As soon as a bucket holds MQTT_MAX_BATCH_ITEMS payloads (and for every
+       non-empty bucket at the end):
+       a. Publishes one "new_collision_batch" message holding "common" and the
+          bucket's payloads, without waiting for it, and empties the bucket.
+       b. Collects broker confirmations (PUBACKs) per slab of in-flight
+          messages, with one shared deadline per slab.
+    6. Keeps the connection open for the next run in the same process
+       (e.g. run_cron), or disconnects when --close is given. An atexit
+       hook disconnects cleanly when the process ends. A kept connection
+       runs its network loop in a loop_start() thread; one-shot --close runs
+       pump the loop inline instead.
+    7. After each confirmed slab, sets `published_to_mqtt` to True for its
+       collisions in chunks of MARK_PUBLISHED_CHUNK_SIZE IDs, on the same
+       connection (between keyset pages, so no SELECT is running). Memory
+       stays bounded by the open buckets and one slab. Collisions of a
+       failed UPDATE stay unpublished and are sent again next run.
     8. Logs progress and errors using Django's logging framework.
+
+    With --workers N, steps 3-6 run in N worker processes, each with its
+    own MQTT connection and a disjoint id range of the backlog. Workers only
+    publish and return the IDs the broker confirmed; the parent process marks
+    all of them in one transaction once every worker is done.
     """
+    # call_command(..., collision_ids=[...]) publishes just those collisions
+    stealth_options = ('collision_ids',)
     help = 'Checks for unpublished collisions and publishes them via MQTT.'
 
     def _sanitize_topic_segment(self, segment_value, placeholder='_unknown_'):
@@ -66,260 +210,504 @@ class Command(BaseCommand):
         """
         if not segment_value:
             return placeholder
-        # Convert to string first to handle potential non-string types
-        segment_str = str(segment_value)
-        # Replace characters forbidden in topic segments
-        sanitized = segment_str.replace('+', '_').replace('#', '_').replace('/', '_')
+        # Convert to string first to handle potential non-string types, then
+        # replace characters forbidden in topic segments in a single pass
+        sanitized = str(segment_value).translate(_TOPIC_TRANSLATE)
         # Ensure it's not empty after replacements if the original was just forbidden chars
         return sanitized if sanitized else placeholder
 
-    def handle(self, *args, **options):
-        """
-        The main execution method called by Django's manage.py.
-
-        Orchestrates the process of finding, publishing, and marking collisions.
-        Handles MQTT connection, publishing loop, and database updates.
-        Provides feedback to the console and logs detailed information.
+    def _confirm_publishes(self, pending, timeout, pump_client=None):
         """
-        start_time = time.time()
-        self.stdout.write("Starting MQTT collision publisher...")
-
-        # --- Prerequisite Checks ---
-        if not mqtt_available:
-            self.stderr.write(self.style.ERROR(
-                "CRITICAL: 'paho-mqtt' library not found. "
-                "Please install it (`pip install paho-mqtt`). Cannot publish."
-            ))
-            return
-
-        # --- Configuration ---
-        mqtt_broker_host = getattr(settings, 'MQTT_BROKER_HOST', None)
-        mqtt_broker_port = getattr(settings, 'MQTT_BROKER_PORT', 1883)
-        mqtt_username = getattr(settings, 'MQTT_USERNAME', None)
-        mqtt_password = getattr(settings, 'MQTT_PASSWORD', None)
-        base_topic = getattr(settings, 'MQTT_BASE_COLLISION_TOPIC', 'vts/collisions')
+        Waits for the broker to acknowledge a slab of in-flight publishes.
 
-        if not mqtt_broker_host:
-            self.stderr.write(self.style.ERROR(
-                "CRITICAL: MQTT_BROKER_HOST setting is not configured in settings.py. Cannot connect."
-            ))
-            return
+        All messages in the slab share one deadline, so confirming them costs
+        about one broker round trip instead of one per message.
 
-        mqtt_client = None
-        published_count = 0
-        processed_count = 0
-        db_update_failed_flag = False
-        successfully_marked_ids = [] # Track IDs actually marked in DB
+        Args:
+            pending: List of (collision_ids, topic, MQTTMessageInfo) tuples, one per
+                batch message.
+            timeout (float): Seconds to wait for the whole slab.
+            pump_client: Client whose network loop runs inline (no loop_start() thread);
+                its PUBACKs are read here until the slab is acknowledged or the deadline passes.
 
-        # --- Find Unpublished Collisions ---
-        try:
-            # Important: select_related to avoid N+1 queries when accessing related fields
-            # like transit_information and bus_route inside the loop.
-            collisions_to_publish = DetectedCollision.objects.filter(
-                published_to_mqtt=False
-            ).select_related(
-                'transit_information', 'bus_route'
-            ).order_by('detection_timestamp') # Process oldest first for chronological order
-
-            processed_count = collisions_to_publish.count()
-            if not collisions_to_publish:
-                self.stdout.write(self.style.SUCCESS("No new collisions found to publish."))
-                # No need to connect to MQTT if there's nothing to send
-                return
+        Returns:
+            tuple: (list of confirmed collision IDs, number of collisions whose
+                   message was not confirmed)
+        """
+        confirmed_ids = []
+        failures = 0
+        deadline = time.monotonic() + timeout
+        debug_enabled = logger.isEnabledFor(logging.DEBUG) # Checked once, not per message
+        if pump_client is not None:
+            # PUBACKs mostly arrive in publish order, so only the oldest unconfirmed message is checked
+            index = 0
+            while index < len(pending):
+                result_info = pending[index][2]
+                if result_info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_AGAIN) or result_info.is_published():
+                    index += 1
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or pump_client.loop(timeout=min(remaining, 1.0)) != mqtt.MQTT_ERR_SUCCESS:
+                    break # Deadline passed or connection lost; the rest is reported below
+
+        for collision_ids, topic, result_info in pending:
+            try:
+                # ValueError: the message was never queued; RuntimeError: the client lost its connection
+                if pump_client is None:
+                    result_info.wait_for_publish(timeout=max(0.0, deadline - time.monotonic()))
+                published = result_info.is_published()
+            except (ValueError, RuntimeError) as e:
+                logger.warning("MQTT publish confirmation error (%s) for collisions %s to %s. Will retry next cycle.", type(e).__name__, collision_ids, topic)
+                failures += len(collision_ids)
+                continue # Don't mark as published
+
+            if published:
+                confirmed_ids.extend(collision_ids)
+                if debug_enabled:
+                    logger.debug("Successfully published %s collisions to %s (MID: %s)", len(collision_ids), topic, result_info.mid)
+            else:
+                # Not acknowledged before the deadline
+                logger.warning("MQTT publish confirmation timed out for collisions %s (MID: %s) to topic %s after %ss. Will retry next cycle.", collision_ids, result_info.mid, topic, timeout)
+                failures += len(collision_ids)
+        return confirmed_ids, failures
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes, each with its own MQTT connection, that publish disjoint id ranges of the backlog (default: 1).',
+        )
+        parser.add_argument(
+            '--close',
+            action='store_true',
+            help='Disconnect from the broker when done instead of keeping the connection for the next run in this process.',
+        )
 
-            self.stdout.write(f"Found {processed_count} unpublished collisions. Attempting to publish...")
+    def _connect(self, config, background_loop=True):
+        """
+        Connects a new MQTT client to the configured broker.
 
-        except Exception as e:
-            logger.error(f"Database error fetching collisions: {e}", exc_info=True)
-            self.stderr.write(self.style.ERROR(f"Database error fetching collisions: {e}. Aborting."))
-            return
+        With background_loop the network loop runs in a loop_start() thread, which keeps
+        the connection alive between runs. Without it no thread is started and the caller
+        pumps the loop inline; used for one-shot connections, where a network thread
+        only competes with the publishing loop for the GIL.
 
-        # --- Connect to MQTT ---
+        Returns:
+            The connected client, or None if the connection failed (errors are reported).
+        """
+        mqtt_client = None
         try:
-            # Use V1 API for compatibility as shown in the original code
-            mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+            mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+            # Allow a full slab of QoS 1 messages to be in flight while waiting for PUBACKs
+            mqtt_client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+            # Unbounded outgoing queue: publish() never rejects a message for queue size
+            mqtt_client.max_queued_messages_set(0)
 
             # Set credentials if provided
-            if mqtt_username and mqtt_password:
-                mqtt_client.username_pw_set(mqtt_username, mqtt_password)
+            if config['username'] and config['password']:
+                mqtt_client.username_pw_set(config['username'], config['password'])
                 self.stdout.write("Using MQTT username/password authentication.")
-            elif mqtt_username:
+            elif config['username']:
                  self.stdout.write("Using MQTT username authentication (no password provided).")
             else:
                  self.stdout.write("Connecting to MQTT without authentication.")
 
-            # Set connection timeout (default is often short)
+            # Signalled from the network thread as soon as the broker accepts the connection (successful CONNACK)
+            connected_event = threading.Event()
+
+            def on_connect(client, userdata, flags, reason_code, properties):
+                if reason_code.is_failure:
+                    logger.error("MQTT broker refused the connection: %s", reason_code)
+                else:
+                    connected_event.set()
+
+            mqtt_client.on_connect = on_connect
+
             connect_timeout = 10 # seconds
-            mqtt_client.connect(mqtt_broker_host, mqtt_broker_port, keepalive=60) # keepalive interval
-            mqtt_client.loop_start() # Start background thread for network traffic & callbacks
-            # Note: Actual connect timeout isn't directly settable here in paho V1 connect,
-            # it's handled internally. loop_start handles reconnect logic.
-            # We rely on the connect call raising an exception if immediate connection fails.
-            # A short sleep might help confirm connection, but loop_start handles it.
-            time.sleep(1) # Give a moment for the connection background thread
-            if not mqtt_client.is_connected():
-                 # Check connection status after starting loop
-                 raise ConnectionRefusedError("MQTT client failed to connect after loop_start.")
-
-            self.stdout.write(f"Successfully connected to MQTT Broker {mqtt_broker_host}:{mqtt_broker_port}")
+            mqtt_client.connect(config['host'], config['port'], keepalive=60) # keepalive interval
+            self._tune_socket(mqtt_client.socket())
+            # Wait for the CONNACK instead of sleeping a fixed time: returns as soon as the broker
+            # answers, and still allows slow networks up to connect_timeout.
+            if background_loop:
+                mqtt_client.loop_start() # Start background thread for network traffic & callbacks
+                connected_event.wait(timeout=connect_timeout)
+            else:
+                deadline = time.monotonic() + connect_timeout
+                while not connected_event.is_set() and time.monotonic() < deadline:
+                    if mqtt_client.loop(timeout=0.1) != mqtt.MQTT_ERR_SUCCESS:
+                        break
+            if not connected_event.is_set():
+                 raise ConnectionRefusedError(f"MQTT client failed to connect within {connect_timeout}s.")
+
+            self.stdout.write(f"Successfully connected to MQTT Broker {config['host']}:{config['port']}")
+            return mqtt_client
 
         except ConnectionRefusedError as e:
-            logger.error(f"MQTT Connection Refused: {e}", exc_info=True)
+            logger.error("MQTT Connection Refused: %s", e, exc_info=True)
             self.stderr.write(self.style.ERROR(f"MQTT Connection Refused: {e}. Check host, port, credentials, and firewall."))
             if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops if started partially
-            return
+            return None
         except Exception as e:
-            logger.error(f"Could not connect to MQTT Broker: {e}", exc_info=True)
+            logger.error("Could not connect to MQTT Broker: %s", e, exc_info=True)
             self.stderr.write(self.style.ERROR(f"Could not connect to MQTT Broker: {e}. Aborting publish cycle."))
             if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops
-            return
+            return None
 
-        # --- Publish Loop ---
-        ids_to_mark_published = [] # Store IDs confirmed published by the broker
-        publish_failures = 0
+    def _tune_socket(self, sock):
+        """
+        Disables Nagle's algorithm, so small PUBLISH packets are sent at once instead
+        of being held back for coalescing, and enlarges the send buffer.
+        Best effort: failures only cost throughput, so they are just logged.
+        """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SEND_BUFFER_SIZE)
+        except (AttributeError, OSError) as e:
+            logger.warning("Could not tune the MQTT socket options: %s", e)
 
-        for collision in collisions_to_publish:
+    def _get_or_create_client(self, config):
+        """
+        Returns the shared, connected MQTT client, connecting a new one if there is
+        none yet or the previous connection was lost.
+
+        Returns:
+            The connected client, or None if the connection failed.
+        """
+        global _MQTT_CLIENT
+        if _MQTT_CLIENT is not None and _MQTT_CLIENT.is_connected():
+            self.stdout.write("Reusing existing MQTT connection.")
+            return _MQTT_CLIENT
+        if _MQTT_CLIENT is not None:
+            self._disconnect(_MQTT_CLIENT) # Stop the stale client's network loop
+        _MQTT_CLIENT = self._connect(config)
+        return _MQTT_CLIENT
+
+    def _disconnect(self, mqtt_client):
+        """Stops the network loop and disconnects the client."""
+        global _MQTT_CLIENT
+        if mqtt_client is _MQTT_CLIENT:
+            _MQTT_CLIENT = None
+        if mqtt_client.is_connected():
+            self.stdout.write("Disconnecting from MQTT Broker...")
             try:
-                # --- Prepare Payload ---
-                # Ensure related objects exist before accessing attributes
-                transit_info = collision.transit_information
-                bus_route = collision.bus_route # Can be None if relation allows null
+                mqtt_client.loop_stop() # Stop the background thread cleanly (no-op for inline-pumped clients)
+                mqtt_client.disconnect()
+                self.stdout.write("Disconnected from MQTT Broker.")
+            except Exception as e:
+                 logger.warning("Error during MQTT disconnect: %s", e, exc_info=True)
+                 # Continue anyway, the connection will likely time out on the broker side.
+        else:
+             # If client exists but isn't connected (e.g., connection dropped during the publish)
+             try:
+                 mqtt_client.loop_stop() # Attempt to stop loop just in case
+             except Exception: pass # Ignore errors if loop wasn't running
 
-                payload = {
-                    "event": "new_collision", # Type of event
-                    "collision_id": collision.id,
-                    "transit_id": collision.transit_information_id,
-                    "route_id": collision.bus_route_id, # Foreign key value
-                    "lon": collision.transit_lon,
-                    "lat": collision.transit_lat,
-                    "tolerance": collision.tolerance_meters,
-                    "detected_at": collision.detection_timestamp.isoformat() if collision.detection_timestamp else None,
-                    # Safely access related fields
-                    "severity": transit_info.severity if transit_info else None,
-                    "filter_used": transit_info.filter_used if transit_info else None,
-                    "situation_id": transit_info.situation_id if transit_info else None,
-                    "Bus_number": bus_route.route_id if bus_route else None, # Use the actual route identifier field
-                    "comment": transit_info.comment if transit_info else None
-                }
+    def publish_collisions(self, collisions_to_publish, config, close=False, on_confirmed=None):
+        """
+        Publishes collision rows over the shared MQTT connection.
+
+        Args:
+            collisions_to_publish: Iterable of collision value dicts (see unpublished_collision_values).
+            config (dict): MQTT connection and topic settings built by handle().
+            close (bool): Disconnect when done instead of keeping the connection for the next run.
+                Without a live shared connection to reuse, the run then uses its own client
+                whose network loop is pumped inline instead of by a loop_start() thread.
+            on_confirmed: Called with the list of collision IDs of each confirmed slab instead
+                of marking them as published here (marked_count is then 0).
+
+        Returns:
+            tuple: (processed_count, published_count, marked_count, failure count), or
+                   None if the broker connection failed.
+        """
+        # One-shot runs (--close, worker processes) don't need a thread keeping the connection alive
+        inline_loop = close and not (_MQTT_CLIENT is not None and _MQTT_CLIENT.is_connected())
+        if inline_loop:
+            mqtt_client = self._connect(config, background_loop=False)
+        else:
+            mqtt_client = self._get_or_create_client(config)
+        if mqtt_client is None:
+            return None
+        pump_client = mqtt_client if inline_loop else None
+
+        base_topic = config['base_topic']
+        max_batch_items = config['max_batch_items']
+        processed_count = 0
 
+        # --- Group payloads by topic, publishing each bucket as soon as it is full ---
+        # Collisions sharing a (route, severity, filter) topic are sent together in one message.
+        # Those three fields are the same for the whole bucket, so they are left out of the
+        # items and sent once per message as "common".
+        buckets = {} # (Bus_number, severity, filter_used) -> (topic, common, list of (collision_id, payload))
+        publish_failures = 0
+        published_count = 0
+        mark_stats = {'marked': 0, 'failed': 0}
+        pending = [] # (collision_ids, topic, MQTTMessageInfo) published but not yet confirmed
+        sanitize = self._sanitize_topic_segment
+
+        def confirm_pending():
+            """Waits for the in-flight slab's PUBACKs and marks its confirmed collisions as published."""
+            nonlocal published_count, publish_failures, pending
+            confirmed_ids, failures = self._confirm_publishes(pending, PUBLISH_CONFIRM_TIMEOUT, pump_client)
+            if on_confirmed is None:
+                _mark_published(confirmed_ids, mark_stats)
+            else:
+                on_confirmed(confirmed_ids)
+            published_count += len(confirmed_ids)
+            publish_failures += failures
+            pending = []
+
+        def publish_batch(topic, common, batch):
+            """Publishes one batch message without waiting for it (confirmed per slab)."""
+            nonlocal publish_failures
+            collision_ids = [collision_id for collision_id, _ in batch]
+            try:
                 # --- Serialize Payload ---
-                try:
-                    # ensure_ascii=False is important for non-English characters in comments etc.
-                    payload_json = json.dumps(payload, ensure_ascii=False)
-                except TypeError as e:
-                    logger.error(f"Error serializing payload for collision {collision.id}: {e}. Data: {payload}", exc_info=True)
-                    self.stderr.write(f"Error serializing payload for collision {collision.id}: {e}. Skipping.")
-                    publish_failures += 1
-                    continue # Skip this collision
-
-                # --- Construct Topic ---
-                bus_route_id_str = self._sanitize_topic_segment(payload["Bus_number"]) # Use the actual route ID from payload
-                severity_str = self._sanitize_topic_segment(payload["severity"])
-                filter_str = self._sanitize_topic_segment(payload["filter_used"])
-
-                # Example: vts/collisions/route/101/severity/high/filter/some_filter
-                topic = f"{base_topic}/route/{bus_route_id_str}/severity/{severity_str}/filter/{filter_str}"
+                # orjson emits UTF-8 bytes directly, which publish() accepts as-is
+                payload_json = orjson.dumps(
+                    {"event": "new_collision_batch", "common": common, "items": [payload for _, payload in batch]}
+                )
 
                 # --- Publish ---
                 # Publish with QoS 1 (at least once delivery) for better reliability
                 # QoS 2 (exactly once) is safer but higher overhead. QoS 0 (at most once) is fire-and-forget.
-                qos = 1
-                result_info = mqtt_client.publish(topic, payload_json, qos=qos)
-
-                # Wait for acknowledgment for QoS 1 or 2
-                # Timeout should be reasonable, e.g., 5 seconds.
-                publish_timeout = 5.0
-                try:
-                     # wait_for_publish can raise an exception on timeout for some paho versions
-                     # or just return without is_published() being true.
-                    result_info.wait_for_publish(timeout=publish_timeout)
-                except ValueError:
-                    # Some paho-mqtt versions might raise ValueError if message delivery failed
-                    logger.warning(f"MQTT publish confirmation error (ValueError) for collision {collision.id} to {topic}. Will retry next cycle.")
-                    publish_failures += 1
-                    continue # Don't mark as published
-                except RuntimeError:
-                     # Can be raised if loop isn't running, etc.
-                    logger.warning(f"MQTT publish confirmation error (RuntimeError) for collision {collision.id} to {topic}. Will retry next cycle.")
-                    publish_failures += 1
-                    continue # Don't mark as published
-
-                # Explicitly check if published after waiting
-                if result_info.is_published():
-                    published_count += 1
-                    ids_to_mark_published.append(collision.id) # Add ID to list for bulk update later
-                    logger.debug(f"Successfully published collision {collision.id} to {topic} (QoS {qos}, MID: {result_info.mid})")
-                else:
-                    # This path is taken if wait_for_publish timed out or failed silently
-                    logger.warning(f"MQTT publish confirmation timed out or failed for collision {collision.id} (MID: {result_info.mid}) to topic {topic} after {publish_timeout}s. Will retry next cycle.")
-                    publish_failures += 1
-                    # DO NOT add to ids_to_mark_published if confirmation fails or times out
-
-            except AttributeError as e:
-                 # Catch errors if related objects (transit_info, bus_route) are None unexpectedly
-                 logger.error(f"Error accessing attributes for collision {collision.id}: {e}. Check data integrity.", exc_info=True)
-                 self.stderr.write(f"Data error for collision {collision.id}: {e}. Skipping.")
-                 publish_failures += 1
+                # Confirmation is not awaited here: PUBACKs are handled by the loop_start() thread
+                # (or read inline) while further messages are published, and collected per slab.
+                result_info = mqtt_client.publish(topic, payload_json, qos=1)
+                pending.append((collision_ids, topic, result_info))
+                if inline_loop and mqtt_client.want_write():
+                    mqtt_client.loop_write() # Flush what publish() could not write at once
+            except orjson.JSONEncodeError as e:
+                logger.error("Error serializing payload for collisions %s: %s", collision_ids, e, exc_info=True)
+                self.stderr.write(f"Error serializing payload for collisions {collision_ids}: {e}. Skipping.")
+                publish_failures += len(collision_ids)
+                return
             except Exception as pub_e:
-                # Catch other potential errors during payload prep or publish call
-                logger.error(f"Unexpected error during publish loop for collision {collision.id}: {pub_e}", exc_info=True)
-                self.stderr.write(f"Unexpected error for collision {collision.id}: {pub_e}. Skipping.")
-                publish_failures += 1
-                # DO NOT add to ids_to_mark_published on error
+                # Catch errors from the publish call
+                logger.error("Unexpected error publishing collisions %s to %s: %s", collision_ids, topic, pub_e, exc_info=True)
+                self.stderr.write(f"Unexpected error for collisions {collision_ids}: {pub_e}. Skipping.")
+                publish_failures += len(collision_ids)
+                return # DO NOT mark as published on error
+
+            if len(pending) >= MAX_INFLIGHT_MESSAGES:
+                confirm_pending()
 
-        # --- Mark as Published in DB ---
-        if ids_to_mark_published:
-            self.stdout.write(f"Attempting to mark {len(ids_to_mark_published)} collisions as published in the database...")
+        for collision in collisions_to_publish:
+            processed_count += 1
             try:
-                # Use a transaction to ensure atomicity: either all are marked or none are.
-                with transaction.atomic():
-                    updated_count = DetectedCollision.objects.filter(
-                        id__in=ids_to_mark_published,
-                        published_to_mqtt=False # Ensure we only update those not already marked
+                # --- Prepare Payload ---
+                # Related fields are None when the relation is empty.
+                collision_id = collision['id']
+                bus_number = collision['bus_route__route_id'] # Use the actual route identifier field
+                severity = collision['transit_information__severity']
+                filter_used = collision['transit_information__filter_used']
+                payload = {
+                    "collision_id": collision_id,
+                    "transit_id": collision['transit_information_id'],
+                    "route_id": collision['bus_route_id'], # Foreign key value
+                    "lon": collision['transit_lon'],
+                    "lat": collision['transit_lat'],
+                    "tolerance": collision['tolerance_meters'],
+                    "detected_at": collision['detection_timestamp'], # orjson writes datetimes as ISO 8601
+                    "situation_id": collision['transit_information__situation_id'],
+                    "comment": collision['transit_information__comment'],
+                }
+                bucket = buckets.get((bus_number, severity, filter_used))
+                if bucket is None:
+                    # --- Construct Topic --- (once per bucket)
+                    # Example: vts/collisions/route/101/severity/high/filter/some_filter
+                    topic = f"{base_topic}/route/{sanitize(bus_number)}/severity/{sanitize(severity)}/filter/{sanitize(filter_used)}"
+                    # Serialized once and embedded as-is in every message of the bucket
+                    common = orjson.Fragment(orjson.dumps(
+                        {"Bus_number": bus_number, "severity": severity, "filter_used": filter_used}
+                    ))
+                    bucket = buckets[(bus_number, severity, filter_used)] = (topic, common, [])
+                bucket[2].append((collision_id, payload))
+
+            except Exception as e:
+                logger.error("Unexpected error preparing collision %s: %s", collision['id'], e, exc_info=True)
+                self.stderr.write(f"Unexpected error for collision {collision['id']}: {e}. Skipping.")
+                publish_failures += 1
+                continue
+
+            # A full bucket is sent right away, so at most max_batch_items payloads per topic are held
+            topic, common, items = bucket
+            if len(items) >= max_batch_items:
+                publish_batch(topic, common, items)
+                items.clear()
+
+        # --- Publish the partially filled buckets ---
+        for topic, common, items in buckets.values():
+            if items:
+                publish_batch(topic, common, items)
+
+        # --- Confirm the last slab of in-flight publishes ---
+        if pending:
+            confirm_pending()
+
+        if mark_stats['failed']:
+            self.stderr.write(self.style.ERROR(
+                f"CRITICAL: Failed to mark {mark_stats['failed']} collisions as published. These collisions WILL be re-published on the next run."
+            ))
+
+        if close:
+            self._disconnect(mqtt_client)
+        return processed_count, published_count, mark_stats['marked'], publish_failures
+
+    def publish_in_workers(self, unpublished, config, workers):
+        """
+        Splits the backlog into `workers` disjoint id ranges and publishes each range
+        from its own process and MQTT connection. The IDs confirmed by all workers are
+        then marked as published here, in one transaction.
+
+        Returns:
+            tuple: (processed_count, published_count, marked_count, failure count), or
+                   None if no worker could connect to the broker.
+        """
+        collision_ids = list(unpublished.order_by('id').values_list('id', flat=True))
+        total = len(collision_ids)
+        slabs = [collision_ids[i * total // workers:(i + 1) * total // workers] for i in range(workers)]
+        id_ranges = [(slab[0], slab[-1]) for slab in slabs if slab]
+        self.stdout.write(f"Publishing {total} collisions from {len(id_ranges)} worker processes...")
+
+        processed_count = 0
+        published_count = 0
+        publish_failures = 0
+        confirmed_ids = []
+        connected = False
+        # A forked worker would share this process's DB connection and the socket of the
+        # shared MQTT client, so the workers start from a fresh interpreter instead
+        with ProcessPoolExecutor(
+            max_workers=len(id_ranges), mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+        ) as executor:
+            futures = [executor.submit(_publish_id_range, first_id, last_id, config) for first_id, last_id in id_ranges]
+            for future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error("Publish worker failed: %s", e, exc_info=True)
+                    self.stderr.write(self.style.ERROR(f"Publish worker failed: {e}. Its collisions will be retried next run."))
+                    continue
+                if result is None:
+                    continue
+                connected = True
+                worker_processed, worker_published, worker_failures, worker_confirmed_ids = result
+                processed_count += worker_processed
+                published_count += worker_published
+                publish_failures += worker_failures
+                confirmed_ids.extend(worker_confirmed_ids)
+        if not connected:
+            return None
+
+        marked_count = 0
+        try:
+            with transaction.atomic():
+                for start in range(0, len(confirmed_ids), MARK_PUBLISHED_CHUNK_SIZE):
+                    marked_count += DetectedCollision.objects.filter(
+                        id__in=confirmed_ids[start:start + MARK_PUBLISHED_CHUNK_SIZE],
+                        published_to_mqtt=False,
                     ).update(published_to_mqtt=True)
+        except Exception as e:
+            # Rolled back as a whole: every confirmed collision is sent again next run
+            marked_count = 0
+            logger.error("Failed to mark %s collisions as published in database: %s", len(confirmed_ids), e, exc_info=True)
+            self.stderr.write(self.style.ERROR(
+                f"CRITICAL: Failed to mark {len(confirmed_ids)} collisions as published. These collisions WILL be re-published on the next run."
+            ))
+        return processed_count, published_count, marked_count, publish_failures
 
-                successfully_marked_ids = ids_to_mark_published # If transaction succeeded
-                if updated_count != len(ids_to_mark_published):
-                    logger.warning(f"DB Update count mismatch: Expected {len(ids_to_mark_published)}, updated {updated_count}. Some might have been updated concurrently?")
-                    # Still report the number successfully updated by *this* process.
-                    self.stdout.write(f"Successfully marked {updated_count} collisions as published in the database.")
-                else:
-                    self.stdout.write(f"Successfully marked {updated_count} collisions as published in the database.")
-
-            except Exception as db_e:
-                 logger.error(f"Failed to mark collisions {ids_to_mark_published} as published in database: {db_e}", exc_info=True)
-                 self.stderr.write(self.style.ERROR(f"CRITICAL: Failed to mark collisions as published: {db_e}. These collisions WILL be re-published on the next run."))
-                 # Set flag to indicate DB update failure in summary
-                 db_update_failed_flag = True
-                 successfully_marked_ids = [] # Reset this list as the update failed
-
-        elif published_count > 0:
-             # This case should ideally not happen if publish succeeded but marking list is empty,
-             # but good to log if it does.
-             logger.warning("Published count > 0 but no IDs were queued for DB update. Check logic.")
-
-        # --- Cleanup MQTT ---
-        if mqtt_client and mqtt_client.is_connected():
-            self.stdout.write("Disconnecting from MQTT Broker...")
+    def handle(self, *args, **options):
+        """
+        The main execution method called by Django's manage.py.
+        """
+        self.publish(
+            collision_ids=options.get('collision_ids'),
+            workers=options.get('workers') or 1,
+            close=options.get('close', False),
+        )
+
+    def publish(self, collision_ids=None, workers=1, close=False):
+        """
+        Orchestrates the process of finding, publishing, and marking collisions.
+        Handles MQTT connection, publishing loop, and database updates.
+        Provides feedback to the console and logs detailed information.
+        handle() passes the command-line options on to this method; run_cron calls it
+        directly with no arguments, to publish the whole unpublished backlog.
+
+        Args:
+            collision_ids (list): Publish just these collisions (e.g. the ones run_cron
+                just stored) instead of scanning for every unpublished one. Always
+                published from this process, whatever `workers` is.
+            workers (int): Worker processes for publishing the unpublished backlog.
+            close (bool): Disconnect from the broker when done.
+        """
+        start_time = time.time()
+
+        if collision_ids is not None:
+            if not collision_ids:
+                self.stdout.write(self.style.SUCCESS("No new collisions found to publish."))
+                return
+            unpublished = None # The explicit IDs are fetched in slabs by collision_values_for_ids()
+            workers = 1
+        else:
+            # --- Find Unpublished Collisions ---
+            # Checked before anything else: on an idle system this single
+            # SELECT ... LIMIT 1 is all a run costs.
             try:
-                mqtt_client.loop_stop() # Stop the background thread cleanly
-                mqtt_client.disconnect()
-                self.stdout.write("Disconnected from MQTT Broker.")
+                unpublished = DetectedCollision.objects.filter(published_to_mqtt=False)
+                if not unpublished.exists():
+                    self.stdout.write(self.style.SUCCESS("No new collisions found to publish."))
+                    # No need to connect to MQTT if there's nothing to send
+                    return
             except Exception as e:
-                 logger.warning(f"Error during MQTT disconnect: {e}", exc_info=True)
-                 # Continue anyway, the connection will likely time out on the broker side.
+                logger.error("Database error fetching collisions: %s", e, exc_info=True)
+                self.stderr.write(self.style.ERROR(f"Database error fetching collisions: {e}. Aborting."))
+                return
 
-        elif mqtt_client:
-             # If client exists but isn't connected (e.g., initial connection failed after loop_start)
-             try:
-                 mqtt_client.loop_stop() # Attempt to stop loop just in case
-             except Exception: pass # Ignore errors if loop wasn't running
+        self.stdout.write("Starting MQTT collision publisher...")
+
+        # --- Prerequisite Checks ---
+        if not mqtt_available:
+            self.stderr.write(self.style.ERROR(
+                "CRITICAL: 'paho-mqtt' library not found. "
+                "Please install it (`pip install paho-mqtt`). Cannot publish."
+            ))
+            return
+
+        # --- Configuration ---
+        config = {
+            'host': getattr(settings, 'MQTT_BROKER_HOST', None),
+            'port': getattr(settings, 'MQTT_BROKER_PORT', 1883),
+            'username': getattr(settings, 'MQTT_USERNAME', None),
+            'password': getattr(settings, 'MQTT_PASSWORD', None),
+            'base_topic': getattr(settings, 'MQTT_BASE_COLLISION_TOPIC', 'vts/collisions'),
+            'max_batch_items': max(1, getattr(settings, 'MQTT_MAX_BATCH_ITEMS', 200)), # Collisions per MQTT message
+        }
+        workers = max(1, workers)
+
+        if not config['host']:
+            self.stderr.write(self.style.ERROR(
+                "CRITICAL: MQTT_BROKER_HOST setting is not configured in settings.py. Cannot connect."
+            ))
+            return
+
+        self.stdout.write("Found unpublished collisions. Attempting to publish...")
 
+        # --- Publish (confirmed collisions are marked as published while publishing,
+        # or by this process after the workers finish) ---
+        if workers > 1:
+            result = self.publish_in_workers(unpublished, config, workers)
+        elif unpublished is None:
+            result = self.publish_collisions(collision_values_for_ids(collision_ids), config, close=close)
+        else:
+            result = self.publish_collisions(unpublished_collision_values(unpublished), config, close=close)
+        if result is None:
+            return # Could not connect to the broker; already reported
+        processed_count, published_count, marked_count, publish_failures = result
 
         # --- Final Summary ---
         end_time = time.time()
         duration = end_time - start_time
-        marked_count = len(successfully_marked_ids) # Use the list of IDs confirmed marked
 
         summary_message = (
             f"Publish cycle finished in {duration:.2f} seconds. "
@@ -329,17 +717,12 @@ class Command(BaseCommand):
             f"Successfully marked as published in DB: {marked_count}."
         )
 
-        if db_update_failed_flag:
-            self.stderr.write(self.style.ERROR(
+        if marked_count < published_count:
+            # Failed UPDATEs, or rows marked concurrently by another publisher
+            self.stderr.write(self.style.WARNING(
                 f"{summary_message} "
-                f"WARNING: Database update failed for {len(ids_to_mark_published)} items; they will be retried."
+                f"WARNING: {published_count - marked_count} published collisions were not marked in the DB; unmarked ones will be retried. Check logs."
             ))
-        elif published_count != marked_count:
-             # This implies a potential issue (e.g., publish confirmed but DB update failed, or logic error)
-             self.stderr.write(self.style.WARNING(
-                f"{summary_message} "
-                f"WARNING: Mismatch between published count ({published_count}) and DB marked count ({marked_count}). Check logs."
-             ))
         elif published_count == 0 and processed_count > 0:
              # If we processed items but published none
               self.stdout.write(self.style.WARNING(
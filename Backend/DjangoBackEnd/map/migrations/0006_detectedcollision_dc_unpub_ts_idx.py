@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0005_alter_busroute_route_id"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="detectedcollision",
+            name="published_to_mqtt",
+            field=models.BooleanField(
+                default=False,
+                help_text="Flag indicating if this collision has been published via MQTT.",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="detectedcollision",
+            index=models.Index(
+                condition=models.Q(("published_to_mqtt", False)),
+                fields=["published_to_mqtt", "detection_timestamp"],
+                name="dc_unpub_ts_idx",
+            ),
+        ),
+    ]
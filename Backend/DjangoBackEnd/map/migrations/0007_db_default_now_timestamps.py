@@ -0,0 +1,27 @@
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0006_detectedcollision_dc_unpub_ts_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="vtssituation",
+            name="creation_time",
+            field=models.DateTimeField(
+                db_default=django.db.models.functions.datetime.Now()
+            ),
+        ),
+        migrations.AlterField(
+            model_name="busroute",
+            name="last_updated",
+            field=models.DateTimeField(
+                db_default=django.db.models.functions.datetime.Now(),
+                help_text="When this route information was last updated/imported",
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0007_db_default_now_timestamps"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="detectedcollision",
+            name="tolerance_meters",
+            field=models.SmallIntegerField(default=50),
+        ),
+    ]
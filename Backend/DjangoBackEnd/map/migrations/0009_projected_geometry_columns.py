@@ -0,0 +1,93 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+# The projected copies are maintained by triggers, so every writer (ORM saves,
+# bulk upserts, raw SQL) keeps them in sync. ST_Transform runs once per write
+# instead of once per candidate pair in the collision query.
+TRIGGERS = [
+    (
+        "map_vtssituation_location_proj_insert",
+        """
+        CREATE TRIGGER map_vtssituation_location_proj_insert
+        AFTER INSERT ON map_vtssituation
+        BEGIN
+            UPDATE map_vtssituation SET location_proj = ST_Transform(NEW.location, 32633) WHERE id = NEW.id;
+        END
+        """,
+    ),
+    (
+        "map_vtssituation_location_proj_update",
+        """
+        CREATE TRIGGER map_vtssituation_location_proj_update
+        AFTER UPDATE OF location ON map_vtssituation
+        BEGIN
+            UPDATE map_vtssituation SET location_proj = ST_Transform(NEW.location, 32633) WHERE id = NEW.id;
+        END
+        """,
+    ),
+    (
+        "map_busroute_path_proj_insert",
+        """
+        CREATE TRIGGER map_busroute_path_proj_insert
+        AFTER INSERT ON map_busroute
+        BEGIN
+            UPDATE map_busroute SET path_proj = ST_Transform(NEW.path, 32633) WHERE id = NEW.id;
+        END
+        """,
+    ),
+    (
+        "map_busroute_path_proj_update",
+        """
+        CREATE TRIGGER map_busroute_path_proj_update
+        AFTER UPDATE OF path ON map_busroute
+        BEGIN
+            UPDATE map_busroute SET path_proj = ST_Transform(NEW.path, 32633) WHERE id = NEW.id;
+        END
+        """,
+    ),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0008_alter_detectedcollision_tolerance_meters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vtssituation",
+            name="location_proj",
+            field=django.contrib.gis.db.models.fields.PointField(
+                blank=True,
+                editable=False,
+                help_text="Copy of location projected to UTM 33N (SRID 32633), maintained by the database",
+                null=True,
+                spatial_index=False,
+                srid=32633,
+            ),
+        ),
+        migrations.AddField(
+            model_name="busroute",
+            name="path_proj",
+            field=django.contrib.gis.db.models.fields.LineStringField(
+                blank=True,
+                editable=False,
+                help_text="Copy of path projected to UTM 33N (SRID 32633), maintained by the database",
+                null=True,
+                srid=32633,
+            ),
+        ),
+        # Backfill the existing rows
+        migrations.RunSQL(
+            [
+                "UPDATE map_vtssituation SET location_proj = ST_Transform(location, 32633) WHERE location IS NOT NULL",
+                "UPDATE map_busroute SET path_proj = ST_Transform(path, 32633) WHERE path IS NOT NULL",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            [sql for _, sql in TRIGGERS],
+            reverse_sql=[f"DROP TRIGGER IF EXISTS {name}" for name, _ in TRIGGERS],
+        ),
+    ]
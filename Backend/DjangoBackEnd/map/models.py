@@ -1,11 +1,14 @@
 from django.db import models
 from django.contrib.gis.db import models as gis_models # Import GeoDjango models
-from django.utils import timezone
+from django.db.models.functions import Now
 
 class ApiMetadata(models.Model):
     """
     Model to store metadata related to API interactions.
     """
+    # Key of the Last-Modified date of the last stored VTS payload
+    LAST_MODIFIED_KEY = 'last_modified_date'
+
     key = models.CharField(max_length=255, unique=True)
     value = models.TextField()
 
@@ -20,7 +23,9 @@ class VtsSituation(models.Model):
     """
     situation_id = models.CharField(max_length=255, unique=True)
     version = models.CharField(max_length=255)
-    creation_time = models.DateTimeField(default=timezone.now)
+    # Filled in by the database when the INSERT leaves it out. Not auto_now_add,
+    # which would overwrite the creation time read from the VTS feed.
+    creation_time = models.DateTimeField(db_default=Now())
     version_time = models.DateTimeField(null=True, blank=True)
     probability_of_occurrence = models.CharField(max_length=255, null=True, blank=True)
     severity = models.CharField(max_length=255, null=True, blank=True)
@@ -33,6 +38,12 @@ class VtsSituation(models.Model):
     overall_end_time = models.DateTimeField(null=True, blank=True)
     location = gis_models.PointField(srid=4326, null=True, blank=True, help_text="Primary point location (SRID 4326 WGS84)")
     path = gis_models.LineStringField(srid=4326, null=True, blank=True, help_text="LineString path from posList (SRID 4326 WGS84)")
+    # Kept in sync with `location` by a database trigger (migration 0009), so collision
+    # queries don't reproject every point per candidate pair
+    location_proj = gis_models.PointField(
+        srid=32633, null=True, blank=True, editable=False, spatial_index=False,
+        help_text="Copy of location projected to UTM 33N (SRID 32633), maintained by the database"
+    )
     location_description = models.TextField(null=True, blank=True)
     road_number = models.CharField(max_length=255, null=True, blank=True)
     area_name = models.CharField(max_length=255, null=True, blank=True)
@@ -65,6 +76,11 @@ class BusRoute(models.Model):
         srid=4326,
         help_text="Route geometry as a LineString (SRID 4326 WGS84)"
     )
+    # Kept in sync with `path` by a database trigger (migration 0009)
+    path_proj = gis_models.LineStringField(
+        srid=32633, null=True, blank=True, editable=False,
+        help_text="Copy of path projected to UTM 33N (SRID 32633), maintained by the database"
+    )
     version = models.CharField(
         max_length=100,
         null=True,
@@ -72,7 +88,7 @@ class BusRoute(models.Model):
         help_text="Version identifier for this route data (if provided by source)"
     )
     last_updated = models.DateTimeField(
-        default=timezone.now,
+        db_default=Now(), # Set by the database unless the import supplies a timestamp
         help_text="When this route information was last updated/imported"
     )
 
@@ -107,21 +123,27 @@ class DetectedCollision(models.Model):
     transit_lat = models.FloatField()
     # Store when this collision record was created (when the check was run)
     detection_timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
-    tolerance_meters = models.IntegerField(default=50)
-    unique_together = ('transit_information', 'bus_route')
+    tolerance_meters = models.SmallIntegerField(default=50) # Meters; a few hundred at most
     published_to_mqtt = models.BooleanField(
-        default=False,
-        db_index=True, # Index for faster querying of unpublished items
+        default=False, # Unpublished rows are indexed by dc_unpub_ts_idx below
         help_text="Flag indicating if this collision has been published via MQTT."
     )
     class Meta:
         verbose_name = "Detected Collision"
         verbose_name_plural = "Detected Collisions"
-        # Ensure a VTS message isn't listed multiple times for the same route from the same check run
-        # Note: This assumes you clear old data before inserting new.
-        # If updating, you might need a different constraint or logic.
+        # Ensure a VTS message isn't listed multiple times for the same route.
+        # insert_new_collisions() relies on this index (INSERT OR IGNORE) to skip stored pairs.
         unique_together = ('transit_information', 'bus_route')
         ordering = ['-detection_timestamp', 'transit_information']
+        indexes = [
+            # Serves the publisher's filter(published_to_mqtt=False).order_by('detection_timestamp')
+            # in index order; partial, so it only holds the (few) unpublished rows.
+            models.Index(
+                fields=['published_to_mqtt', 'detection_timestamp'],
+                name='dc_unpub_ts_idx',
+                condition=models.Q(published_to_mqtt=False),
+            ),
+        ]
 
     def __str__(self):
         published_status = "[Published]" if self.published_to_mqtt else "[New]"
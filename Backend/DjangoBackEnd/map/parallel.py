@@ -0,0 +1,24 @@
+"""
+Helpers for spreading chunked work over a process pool while the input is still streamed.
+
+Free of Django imports, so standalone scripts (e.g. xml-to-geojson.py) can use them too.
+"""
+from collections import deque
+
+
+def iter_chunk_results(executor, func, chunks, max_in_flight, *args):
+    """
+    Yield the items of func(chunk, *args) for every chunk, in chunk order, with the
+    calls running in `executor`.
+
+    At most `max_in_flight` chunks are submitted ahead of the one being yielded, so a
+    lazily read input (a file or response body) is only read as far as the pool can
+    keep up with, and memory stays bounded by those chunks and their results.
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(func, chunk, *args))
+        if len(pending) >= max_in_flight:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
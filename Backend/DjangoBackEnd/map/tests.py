@@ -1,35 +1,70 @@
-from django.test import TestCase, Client
+import gzip
+import importlib
+import importlib.util
+import io
+import os
+import re
+import tempfile
+from types import SimpleNamespace
+import orjson
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, Client, RequestFactory, override_settings
 from unittest.mock import patch, MagicMock
+from django.core.cache import cache
 from django.core.management import call_command
-from map.models import VtsSituation, ApiMetadata, BusRoute
-from .utils import get_trip_geojson
-from .views import trip, find_all_collisions
+from django.db import connection
+from map.models import VtsSituation, ApiMetadata, BusRoute, DetectedCollision
+from .utils import get_trip_geojson, decode_polyline, insert_new_collisions, linestring_ewkb, linestring_from_array, point_from_xy
+from .parallel import iter_chunk_results
+from .triggers import ensure_projection_triggers
+from .views import trip, find_all_collisions, json_file_response
 from django.contrib.gis.geos import Point, LineString
 
+FETCH_COMMAND_MODULE = "map.management.commands.fetch_vts_situations"
+PUBLISH_COMMAND_MODULE = "map.management.commands.publish_new_collisions"
+
+
+def load_xml_to_geojson():
+    """Import the standalone xml-to-geojson.py script (it is not a package module) with dummy credentials."""
+    spec = importlib.util.spec_from_file_location("xml_to_geojson", settings.BASE_DIR / "xml-to-geojson.py")
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, {"brukernavn": "test", "passord": "test"}):
+        spec.loader.exec_module(module)
+    return module
+
+
 class FetchVtsSituationTest(TestCase):
 
-    @patch("requests.get")
+    def setUp(self):
+        # The command caches the stored Last-Modified date per process
+        from map.management.commands.fetch_vts_situations import _METADATA_CACHE
+        _METADATA_CACHE.clear()
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
     def test_fetch_transit_information_api_failure(self, mock_get):
         """Test API failure handling."""
         # Mock the API response to simulate a failure (HTTP 500)
         mock_response = MagicMock()
         mock_response.status_code = 500
+        mock_response.raise_for_status.side_effect = requests.HTTPError("500 Server Error")
         mock_get.return_value = mock_response
 
         # Capture the logs during the execution of the management command
-        with self.assertLogs("map.management.commands.get_transit_info", level="ERROR") as log:
-            call_command("get_transit_info")
-            # Adjusted assertion to match the actual log message
-            self.assertIn("Error fetching data: HTTP 500", log.output[0])
+        with self.assertLogs(FETCH_COMMAND_MODULE, level="ERROR") as log:
+            call_command("fetch_vts_situations")
+            self.assertIn("HTTP request failed: 500 Server Error", log.output[0])
 
         # Ensure no data has been saved to the database
         self.assertEqual(VtsSituation.objects.count(), 0)
-    @patch("requests.get")
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
     def test_fetch_and_store_transit_information(self, mock_get):
         # Prepare the mock response
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.content = b"""<?xml version="1.0" encoding="UTF-8"?>
+        mock_response.raw = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
         <d2LogicalModel xmlns="http://datex2.eu/schema/3/messageContainer"
                         xmlns:ns12="http://datex2.eu/schema/3/situation"
                         xmlns:common="http://datex2.eu/schema/3/common"
@@ -39,25 +74,40 @@ class FetchVtsSituationTest(TestCase):
                     <ns12:situationRecord id="FERRY1" version="1">
                         <ns12:situationRecordCreationTime>2023-01-01T12:00:00Z</ns12:situationRecordCreationTime>
                         <ns12:transitServiceType>ferry</ns12:transitServiceType>
-                        <!-- Additional necessary fields -->
+                        <ns12:locationReference>
+                            <ns8:coordinatesForDisplay>
+                                <ns8:latitude>69.65</ns8:latitude>
+                                <ns8:longitude>18.95</ns8:longitude>
+                            </ns8:coordinatesForDisplay>
+                            <ns8:gmlLineString>
+                                <ns8:posList>69.65 18.94 69.66 18.96</ns8:posList>
+                            </ns8:gmlLineString>
+                        </ns12:locationReference>
                     </ns12:situationRecord>
                 </ns12:situation>
             </payloadPublication>
         </d2LogicalModel>
-        """  # Your test XML data
+        """)  # Your test XML data
         mock_response.headers = {'Last-Modified': 'Wed, 21 Oct 2020 07:28:00 GMT'}
         mock_get.return_value = mock_response
         # Run your management command
-        call_command('get_transit_info')
+        call_command('fetch_vts_situations')
         self.assertEqual(VtsSituation.objects.count(), 1)
         transit_info = VtsSituation.objects.first()
         self.assertEqual(transit_info.transit_service_type, 'ferry')
-    @patch("requests.get")
+        # Geometries are built from packed EWKB, with posList pairs swapped to (lon, lat)
+        self.assertEqual(transit_info.location.coords, (18.95, 69.65))
+        self.assertEqual(transit_info.path.coords, ((18.94, 69.65), (18.96, 69.66)))
+        self.assertEqual(
+            ApiMetadata.objects.get(key=ApiMetadata.LAST_MODIFIED_KEY).value, 'Wed, 21 Oct 2020 07:28:00 GMT'
+        )
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
     def test_no_action_on_304_response(self, mock_get):
         """Test that when the server responds with 304 Not Modified, no data is updated or saved."""
         # Setup the last_modified_date in ApiMetadata
         last_modified_value = 'Wed, 21 Oct 2020 07:28:00 GMT'
-        ApiMetadata.objects.create(key='last_modified_date', value=last_modified_value)
+        ApiMetadata.objects.create(key=ApiMetadata.LAST_MODIFIED_KEY, value=last_modified_value)
 
         # Prepare the mock response
         mock_response = MagicMock()
@@ -66,24 +116,26 @@ class FetchVtsSituationTest(TestCase):
         mock_get.return_value = mock_response
 
         # Run the management command
-        with patch('map.management.commands.get_transit_info.logger') as mock_logger:
-            call_command('get_transit_info')
+        call_command('fetch_vts_situations')
 
-            # Ensure that appropriate log message was made
-            mock_logger.info.assert_any_call("data not modified!")
+        # The stored date was sent as If-Modified-Since
+        args, kwargs = mock_get.call_args
+        self.assertEqual(kwargs['headers'], {'If-Modified-Since': last_modified_value})
 
         # Ensure no new data was saved to the database
         self.assertEqual(VtsSituation.objects.count(), 0)
-    @patch("requests.get")
+        self.assertEqual(ApiMetadata.objects.get(key=ApiMetadata.LAST_MODIFIED_KEY).value, last_modified_value)
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
     def test_if_modified_since_header_absent_when_no_last_modified_date(self, mock_get):
         """Test that the If-Modified-Since header is not set when there is no last_modified_date in the database."""
         # Ensure that there is no last_modified_date in the database
-        self.assertFalse(ApiMetadata.objects.filter(key='last_modified_date').exists())
+        self.assertFalse(ApiMetadata.objects.filter(key=ApiMetadata.LAST_MODIFIED_KEY).exists())
 
         # Prepare the mock response
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.content = b"""<?xml version="1.0" encoding="UTF-8"?>
+        mock_response.raw = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
         <ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer"
             xmlns:ns3="http://datex2.eu/schema/3/situation"
             xmlns:ns4="http://datex2.eu/schema/3/common">
@@ -98,12 +150,12 @@ class FetchVtsSituationTest(TestCase):
                 </ns3:situation>
             </ns2:payload>
         </ns2:messageContainer>
-        """
+        """)
         mock_response.headers = {}
         mock_get.return_value = mock_response
 
         # Run the management command
-        call_command('get_transit_info')
+        call_command('fetch_vts_situations')
 
         # Ensure that 'If-Modified-Since' header was not used in request
         mock_get.assert_called_once()
@@ -112,41 +164,505 @@ class FetchVtsSituationTest(TestCase):
 
         # Ensure that data was saved to the database
         self.assertEqual(VtsSituation.objects.count(), 1)
-    # @patch("requests.get")
-    # def test_no_last_modified_and_no_publication_time(self, mock_get):
-    #     """Test that when neither Last-Modified header nor publicationTime is available, last_modified_date is not updated."""
-    #     # Prepare the mock response
-    #     mock_response = MagicMock()
-    #     mock_response.status_code = 200
-    #     mock_response.content = b"""<?xml version="1.0" encoding="UTF-8"?>
-    #     <ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer"
-    #         xmlns:ns3="http://datex2.eu/schema/3/situation">
-    #         <ns2:payload>
-    #             <ns3:situation>
-    #                 <ns3:situationRecord id="FERRY1" version="1">
-    #                     <ns3:situationRecordCreationTime>2023-01-01T12:00:00Z</ns3:situationRecordCreationTime>
-    #                     <ns3:transitServiceType>ferry</ns3:transitServiceType>
-    #                 </ns3:situationRecord>
-    #             </ns3:situation>
-    #         </ns2:payload>
-    #     </ns2:messageContainer>
-    #     """
-    #     # No Last-Modified header and no publicationTime in XML
-    #     mock_response.headers = {}
-    #     mock_get.return_value = mock_response
-
-    #     # Run the management command
-    #     with patch('map.management.commands.get_transit_info.logger') as mock_logger:
-    #         call_command('get_transit_info')
-
-    #         # Ensure that appropriate warning was logged
-    #         mock_logger.warning.assert_any_call("No Last-Modified header or publicationTime found in the response.")
-
-    #     # Ensure that the VtsSituation was saved
-    #     self.assertEqual(VtsSituation.objects.count(), 1)
-
-    #     # Ensure that last_modified_date was not updated
-    #     self.assertFalse(ApiMetadata.objects.filter(key='last_modified_date').exists())
+        # Without a Last-Modified header, the payload's publicationTime is stored instead
+        self.assertEqual(
+            ApiMetadata.objects.get(key=ApiMetadata.LAST_MODIFIED_KEY).value, 'Thu, 22 Oct 2020 07:28:00 GMT'
+        )
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
+    def test_no_last_modified_and_no_publication_time(self, mock_get):
+        """Test that when neither Last-Modified header nor publicationTime is available, last_modified_date is not updated."""
+        # Prepare the mock response
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raw = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+        <ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer"
+            xmlns:ns3="http://datex2.eu/schema/3/situation">
+            <ns2:payload>
+                <ns3:situation>
+                    <ns3:situationRecord id="FERRY1" version="1">
+                        <ns3:situationRecordCreationTime>2023-01-01T12:00:00Z</ns3:situationRecordCreationTime>
+                        <ns3:transitServiceType>ferry</ns3:transitServiceType>
+                    </ns3:situationRecord>
+                </ns3:situation>
+            </ns2:payload>
+        </ns2:messageContainer>
+        """)
+        # No Last-Modified header and no publicationTime in XML
+        mock_response.headers = {}
+        mock_get.return_value = mock_response
+
+        # Run the management command
+        with self.assertLogs(FETCH_COMMAND_MODULE, level="ERROR") as log:
+            call_command('fetch_vts_situations')
+            self.assertIn("Could not determine Last-Modified date", "\n".join(log.output))
+
+        # Ensure that the VtsSituation was saved
+        self.assertEqual(VtsSituation.objects.count(), 1)
+
+        # Ensure that last_modified_date was not updated
+        self.assertFalse(ApiMetadata.objects.filter(key=ApiMetadata.LAST_MODIFIED_KEY).exists())
+
+    @patch(f"{FETCH_COMMAND_MODULE}._SESSION.get")
+    def test_truncated_payload_stores_nothing(self, mock_get):
+        """Test that a payload cut off mid-document rolls back its records and keeps the old Last-Modified date."""
+        last_modified_value = 'Wed, 21 Oct 2020 07:28:00 GMT'
+        ApiMetadata.objects.create(key=ApiMetadata.LAST_MODIFIED_KEY, value=last_modified_value)
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        # The first record is complete, the document is not
+        mock_response.raw = io.BytesIO(b"""<?xml version="1.0" encoding="UTF-8"?>
+        <ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer"
+            xmlns:ns3="http://datex2.eu/schema/3/situation">
+            <ns2:payload>
+                <ns3:situation>
+                    <ns3:situationRecord id="FERRY1" version="1">
+                        <ns3:transitServiceType>ferry</ns3:transitServiceType>
+                    </ns3:situationRecord>
+                    <ns3:situationRecord id="FERRY2" vers""")
+        mock_response.headers = {'Last-Modified': 'Thu, 22 Oct 2020 07:28:00 GMT'}
+        mock_get.return_value = mock_response
+
+        with self.assertLogs(FETCH_COMMAND_MODULE, level="ERROR") as log:
+            call_command('fetch_vts_situations')
+            self.assertIn("Could not read the VTS payload", "\n".join(log.output))
+
+        self.assertEqual(VtsSituation.objects.count(), 0)
+        self.assertEqual(ApiMetadata.objects.get(key=ApiMetadata.LAST_MODIFIED_KEY).value, last_modified_value)
+
+
+class GeometryHelperTests(SimpleTestCase):
+    """The packed-EWKB helpers must build the same geometries as the GEOS constructors."""
+
+    def test_point_from_xy(self):
+        point = point_from_xy(18.95, 69.65)
+        self.assertEqual(point, Point(18.95, 69.65, srid=4326))
+        self.assertEqual(point.srid, 4326)
+        self.assertEqual(point_from_xy(500000.0, 7700000.0, srid=25833).srid, 25833)
+
+    def test_linestring_from_array(self):
+        coords = [(18.94, 69.65), (18.96, 69.66), (19.0, 69.7)]
+        line = linestring_from_array(coords)
+        self.assertEqual(line, LineString(coords, srid=4326))
+        self.assertEqual(line.srid, 4326)
+        # The raw EWKB is what GEOS itself writes for the same line
+        self.assertEqual(bytes(linestring_ewkb(coords)), bytes(LineString(coords, srid=4326).ewkb))
+
+    def test_linestring_ewkb_rejects_invalid_coordinates(self):
+        with self.assertRaises(ValueError):
+            linestring_ewkb([(18.94, 69.65)])  # A single point
+        with self.assertRaises(ValueError):
+            linestring_ewkb([(18.94, 69.65, 0.0), (18.96, 69.66, 0.0)])  # Not (x, y) pairs
+        with self.assertRaises(ValueError):
+            linestring_ewkb([])
+
+
+class DecodePolylineTests(SimpleTestCase):
+
+    def test_known_polyline(self):
+        # Example from Google's encoded polyline algorithm documentation
+        decoded = decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decoded.tolist(), [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]])
+
+    def test_precision(self):
+        decoded = decode_polyline("_izlhA~rlgdF_{geC~ywl@_kwzCn`{nI", precision=6)
+        self.assertEqual(decoded.tolist(), [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]])
+
+    def test_empty_polyline(self):
+        self.assertEqual(decode_polyline("").shape, (0, 2))
+
+    def test_invalid_polylines(self):
+        with self.assertRaises(ValueError):
+            decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq")  # Truncated in the middle of a value
+        with self.assertRaises(ValueError):
+            decode_polyline("_p~iF")  # Latitude without longitude
+
+
+class ExtractRouteIdTests(SimpleTestCase):
+
+    def test_matches_regex(self):
+        """extract_route_id() must agree with the re.search(r":(\d+)_", ...) it replaced."""
+        extract_route_id = importlib.import_module("map.management.commands.fetch-coordinates").extract_route_id
+        journey_ids = [
+            "TRO:ServiceJourney:1234_230101",
+            "TRO:ServiceJourney:ab_1:42_x",
+            "TRO:ServiceJourney:_1",
+            "TRO:ServiceJourney:12a_3",
+            "TRO:ServiceJourney:1234",
+            "1234_5",
+            ":7_",
+            "",
+        ]
+        for journey_id in journey_ids:
+            with self.subTest(journey_id=journey_id):
+                match = re.search(r":(\d+)_", journey_id)
+                self.assertEqual(extract_route_id(journey_id), match.group(1) if match else None)
+
+
+class IterChunkResultsTests(SimpleTestCase):
+
+    def test_results_in_chunk_order_with_bounded_read_ahead(self):
+        read = []
+
+        def chunks():
+            for index in range(10):
+                read.append(index)
+                yield [index, index]
+
+        def double(chunk, factor):
+            return [value * factor for value in chunk]
+
+        results = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for value in iter_chunk_results(executor, double, chunks(), 3, 2):
+                results.append(value)
+                # Chunks are only read as far as the in-flight limit allows
+                self.assertLessEqual(len(read), len(results) // 2 + 3)
+        self.assertEqual(results, [value * 2 for index in range(10) for value in (index, index)])
+
+
+class Utm33nToWgs84Tests(SimpleTestCase):
+
+    def test_reference_points(self):
+        """Closed-form conversion against EPSG:25833 -> EPSG:4326 results from PROJ."""
+        xml_to_geojson = load_xml_to_geojson()
+        reference_points = [
+            # (easting, northing) -> (lon, lat)
+            ((500000.0, 7700000.0), (15.0, 69.40928179800217)),
+            ((653000.5, 7733000.25), (18.94661352121181, 69.66088746963109)),
+            ((420000.0, 7600000.0), (13.043692953945639, 68.50105440359854)),
+            ((750000.0, 7850000.0), (21.765752828098876, 70.6293151161481)),
+        ]
+        eastings, northings = zip(*(point for point, _ in reference_points))
+        lons, lats = xml_to_geojson.utm33n_to_wgs84(
+            xml_to_geojson.np.array(eastings), xml_to_geojson.np.array(northings)
+        )
+        for (lon, lat), (_, (expected_lon, expected_lat)) in zip(zip(lons, lats), reference_points):
+            self.assertAlmostEqual(lon, expected_lon, places=9)
+            self.assertAlmostEqual(lat, expected_lat, places=9)
+
+
+class JsonFileResponseTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "output.geojson")
+        self.content = b'{"type":"FeatureCollection","features":[]}'
+        with open(self.path, "wb") as f:
+            f.write(self.content)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        response = json_file_response(self.factory.get("/", **headers), self.path, "not found")
+        self.addCleanup(response.close)
+        return response
+
+    def test_etag_round_trip(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertIn("max-age=", response["Cache-Control"])
+
+        # The same ETag back gets a bodiless 304 with the validators repeated
+        not_modified = self.get(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(not_modified.content, b"")
+
+        # So does a matching If-Modified-Since
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+
+        # A changed file gets a new ETag, so the old one no longer matches
+        with open(self.path, "wb") as f:
+            f.write(self.content + b" ")
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_precompressed_variant(self):
+        with gzip.open(f"{self.path}.gz", "wb") as f:
+            f.write(self.content)
+        plain = self.get()
+        gzipped = self.get(HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(gzipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(gzipped.streaming_content)), self.content)
+        self.assertNotEqual(gzipped["ETag"], plain["ETag"])
+        self.assertIn("Accept-Encoding", gzipped["Vary"])
+
+    def test_missing_file(self):
+        os.remove(self.path)
+        self.assertEqual(self.get().status_code, 404)
+
+
+class CollisionStorageTests(TestCase):
+
+    def setUp(self):
+        self.situation = VtsSituation.objects.create(
+            situation_id="S1", version="1", location=Point(18.95, 69.65, srid=4326)
+        )
+        self.route = BusRoute.objects.create(
+            route_id="42", path=LineString((18.94, 69.6501), (18.96, 69.6501), srid=4326)
+        )
+        # Far away from the situation (about 5 km north)
+        BusRoute.objects.create(route_id="43", path=LineString((18.94, 69.7), (18.96, 69.7), srid=4326))
+
+    def test_insert_new_collisions_returns_inserted_ids(self):
+        inserted_ids = insert_new_collisions(50)
+        self.assertEqual(len(inserted_ids), 1)
+        collision = DetectedCollision.objects.get(id=inserted_ids[0])
+        self.assertEqual(collision.transit_information_id, self.situation.id)
+        self.assertEqual(collision.bus_route_id, self.route.id)
+        self.assertFalse(collision.published_to_mqtt)
+
+        # Already stored pairs are skipped, so nothing is returned the second time
+        self.assertEqual(insert_new_collisions(50), [])
+        self.assertEqual(DetectedCollision.objects.count(), 1)
+
+
+class ProjectedGeometryTests(TestCase):
+
+    def create_rows(self):
+        situation = VtsSituation.objects.create(
+            situation_id="S1", version="1", location=Point(18.95, 69.65, srid=4326)
+        )
+        route = BusRoute.objects.create(
+            route_id="42", path=LineString((18.94, 69.65), (18.96, 69.66), srid=4326)
+        )
+        situation.refresh_from_db()
+        route.refresh_from_db()
+        return situation, route
+
+    def assertProjected(self, situation, route):
+        self.assertIsNotNone(situation.location_proj)
+        self.assertEqual(situation.location_proj.srid, 32633)
+        self.assertIsNotNone(route.path_proj)
+        self.assertEqual(route.path_proj.srid, 32633)
+
+    def test_saved_rows_get_projected_copies(self):
+        self.assertProjected(*self.create_rows())
+
+    def test_triggers_recreated_after_table_rebuild(self):
+        # A migration that rebuilds a table drops its triggers
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%_proj_%'")
+            for (name,) in cursor.fetchall():
+                cursor.execute(f"DROP TRIGGER {name}")
+        situation, route = self.create_rows()
+        self.assertIsNone(situation.location_proj)
+
+        # post_migrate recreates them and projects the rows written in between
+        ensure_projection_triggers()
+        situation.refresh_from_db()
+        route.refresh_from_db()
+        self.assertProjected(situation, route)
+        situation.location = Point(19.0, 69.7, srid=4326)
+        situation.save()
+        situation.refresh_from_db()
+        self.assertAlmostEqual(situation.location_proj.transform(4326, clone=True).x, 19.0, places=6)
+
+
+class FakeMessageInfo:
+    """Stands in for paho's MQTTMessageInfo; the broker acknowledges it or never does."""
+
+    def __init__(self, mid, acknowledged):
+        self.mid = mid
+        self.rc = 0
+        self.acknowledged = acknowledged
+
+    def is_published(self):
+        return self.acknowledged
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class FakeMqttClient:
+    """Connected paho client whose broker never acknowledges messages for route "43"."""
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0):
+        self.messages.append((topic, orjson.loads(payload)))
+        return FakeMessageInfo(len(self.messages), acknowledged="/route/43/" not in topic)
+
+    def is_connected(self):
+        return True
+
+    def want_write(self):
+        return False
+
+    def loop(self, timeout=1.0):
+        return 0
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+@override_settings(MQTT_BROKER_HOST="broker.test", MQTT_MAX_BATCH_ITEMS=200)
+@patch(f"{PUBLISH_COMMAND_MODULE}.PUBLISH_CONFIRM_TIMEOUT", 0.05)
+@patch(f"{PUBLISH_COMMAND_MODULE}.mqtt_available", True)
+@patch(f"{PUBLISH_COMMAND_MODULE}.mqtt", SimpleNamespace(MQTT_ERR_SUCCESS=0, MQTT_ERR_AGAIN=-1), create=True)
+class PublishCollisionsTests(TestCase):
+
+    def setUp(self):
+        situation = VtsSituation.objects.create(
+            situation_id="S1", version="1", severity="high", location=Point(18.95, 69.65, srid=4326)
+        )
+        path = LineString((18.94, 69.65), (18.96, 69.65), srid=4326)
+        self.confirmed = DetectedCollision.objects.create(
+            transit_information=situation, bus_route=BusRoute.objects.create(route_id="42", path=path),
+            transit_lon=18.95, transit_lat=69.65,
+        )
+        self.unconfirmed = DetectedCollision.objects.create(
+            transit_information=situation, bus_route=BusRoute.objects.create(route_id="43", path=path),
+            transit_lon=18.95, transit_lat=69.65,
+        )
+
+    def publish(self, client):
+        from map.management.commands.publish_new_collisions import Command
+        with patch.object(Command, "_connect", return_value=client):
+            Command(stdout=io.StringIO(), stderr=io.StringIO()).publish(close=True)
+
+    def test_only_confirmed_collisions_are_marked(self):
+        client = FakeMqttClient()
+        with self.assertLogs(PUBLISH_COMMAND_MODULE, level="WARNING"):
+            self.publish(client)
+
+        # One batch message per route topic
+        self.assertEqual(
+            sorted(message["items"][0]["collision_id"] for _, message in client.messages),
+            [self.confirmed.id, self.unconfirmed.id],
+        )
+        self.confirmed.refresh_from_db()
+        self.unconfirmed.refresh_from_db()
+        self.assertTrue(self.confirmed.published_to_mqtt)
+        # Never acknowledged, so it is sent again next run
+        self.assertFalse(self.unconfirmed.published_to_mqtt)
+
+    def test_failed_connect_leaves_rows_unpublished(self):
+        self.publish(None)
+        self.assertEqual(DetectedCollision.objects.filter(published_to_mqtt=False).count(), 2)
+
+
+class FilterOptionsCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        VtsSituation.objects.create(situation_id="S1", version="1", area_name="Troms", severity="high", filter_used="ferry")
+        ApiMetadata.objects.create(key=ApiMetadata.LAST_MODIFIED_KEY, value="Wed, 21 Oct 2020 07:28:00 GMT")
+
+    def get_options(self):
+        response = Client().get("/api/filter-options/")
+        self.assertEqual(response.status_code, 200)
+        return orjson.loads(response.content)
+
+    def test_new_last_modified_date_invalidates_the_cached_options(self):
+        self.assertEqual(self.get_options()["counties"], ["Troms"])
+
+        # Served from the cache until a new payload is stored
+        VtsSituation.objects.create(situation_id="S2", version="1", area_name="Finnmark")
+        self.assertEqual(self.get_options()["counties"], ["Troms"])
+
+        ApiMetadata.objects.filter(key=ApiMetadata.LAST_MODIFIED_KEY).update(value="Thu, 22 Oct 2020 07:28:00 GMT")
+        self.assertEqual(self.get_options()["counties"], ["Finnmark", "Troms"])
+
+    def test_options_come_from_one_query(self):
+        VtsSituation.objects.create(situation_id="S2", version="1", area_name="Finnmark", severity="", filter_used="road")
+        # The Last-Modified lookup for the cache key, then one UNION ALL query for all three lists
+        with self.assertNumQueries(2):
+            options = self.get_options()
+        # Sorted and without empty values
+        self.assertEqual(
+            options, {"counties": ["Finnmark", "Troms"], "situation_types": ["ferry", "road"], "severities": ["high"]}
+        )
+
+
+class TripCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch("map.utils._fetch_trip_geojson")
+    def test_identical_requests_share_one_fetch(self, mock_fetch):
+        mock_fetch.return_value = {"type": "FeatureCollection", "features": []}
+        self.assertEqual(get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2"), mock_fetch.return_value)
+        # Place IDs are normalized for the cache key
+        self.assertEqual(get_trip_geojson(" nsr:stopplace:1", "NSR:StopPlace:2 "), mock_fetch.return_value)
+        mock_fetch.assert_called_once()
+
+        # Another trip count is another request
+        get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2", num_trips=3)
+        self.assertEqual(mock_fetch.call_count, 2)
+
+    @patch("map.utils._fetch_trip_geojson", return_value=None)
+    def test_errors_are_not_cached(self, mock_fetch):
+        self.assertIsNone(get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2"))
+        self.assertIsNone(get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2"))
+        self.assertEqual(mock_fetch.call_count, 2)
+
+
+class StoredCollisionsCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.route = BusRoute.objects.create(
+            route_id="42", path=LineString((18.94, 69.65), (18.96, 69.65), srid=4326)
+        )
+
+    def store_collision(self):
+        situation = VtsSituation.objects.create(
+            situation_id="S1", version="1", location=Point(18.95, 69.65, srid=4326)
+        )
+        DetectedCollision.objects.create(
+            transit_information=situation, bus_route=self.route, transit_lon=18.95, transit_lat=69.65
+        )
+        return situation
+
+    def get_collisions(self):
+        response = Client().get("/api/stored_collisions/")
+        self.assertEqual(response.status_code, 200)
+        return orjson.loads(response.content)["stored_collisions"]
+
+    def test_purge_and_insert_invalidate_the_cached_payload(self):
+        first = self.store_collision()
+        self.assertEqual([row["transit_information_id"] for row in self.get_collisions()], [first.id])
+
+        call_command("Purge_VTS_data", stdout=io.StringIO())
+        self.assertEqual(self.get_collisions(), [])
+
+        # Same row count as before the purge, but a new highest id
+        second = self.store_collision()
+        self.assertEqual([row["transit_information_id"] for row in self.get_collisions()], [second.id])
+
+
+class LocationGeojsonViewTests(TestCase):
+
+    def test_streams_point_and_line_features(self):
+        VtsSituation.objects.create(
+            situation_id="S1", version="1", severity="high",
+            location=Point(18.95, 69.65, srid=4326),
+            path=LineString((18.94, 69.65), (18.96, 69.66), srid=4326),
+        )
+        VtsSituation.objects.create(
+            situation_id="S2", version="1", severity="low", location=Point(19.0, 69.7, srid=4326)
+        )
+        response = Client().get("/api/location_geojson/")
+        self.assertEqual(response.status_code, 200)
+        geojson = orjson.loads(b"".join(response.streaming_content))
+        self.assertEqual(geojson["type"], "FeatureCollection")
+        self.assertEqual(
+            [feature["geometry"]["type"] for feature in geojson["features"]], ["Point", "LineString", "Point"]
+        )
+
+        # Filters apply to both the point and the line features
+        response = Client().get("/api/location_geojson/", {"severity": "high"})
+        geojson = orjson.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(geojson["features"]), 2)
+        self.assertTrue(all(feature["properties"]["severity"] == "high" for feature in geojson["features"]))
 
 # class TripPlanningTests(TestCase):
 #     def test_get_trip_geojson(self):
@@ -0,0 +1,60 @@
+"""
+SQLite triggers that keep the projected geometry columns (VtsSituation.location_proj,
+BusRoute.path_proj) in sync with the geometries they are projected from.
+
+Migration 0009 creates them, but SQLite drops a table's triggers whenever a migration
+rebuilds the table (most AlterField/RemoveField operations do), so they are also
+recreated after every migrate run by ensure_projection_triggers().
+"""
+from django.db import connections
+
+from map.models import BusRoute, VtsSituation
+from map.utils import PROJECTED_SRID
+
+# (model, source geometry column, projected column)
+PROJECTED_COLUMNS = [
+    (VtsSituation, 'location', 'location_proj'),
+    (BusRoute, 'path', 'path_proj'),
+]
+
+
+def projection_trigger_sql(table, source_column, projected_column):
+    """CREATE TRIGGER IF NOT EXISTS statements for one projected column (insert and update)."""
+    statements = []
+    for event, when in (('insert', 'AFTER INSERT'), ('update', f'AFTER UPDATE OF {source_column}')):
+        statements.append(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{projected_column}_{event}
+            {when} ON {table}
+            BEGIN
+                UPDATE {table} SET {projected_column} = ST_Transform(NEW.{source_column}, {PROJECTED_SRID}) WHERE id = NEW.id;
+            END
+        """)
+    return statements
+
+
+def ensure_projection_triggers(using='default', **kwargs):
+    """
+    post_migrate handler: (re)create the projection triggers and fill in the projected
+    values of rows written while they were missing. A no-op when the triggers exist
+    and every row is projected, and on databases without the projected columns
+    (other backends, or migrated back to before 0009).
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for model, source_column, projected_column in PROJECTED_COLUMNS:
+            table = model._meta.db_table
+            if table not in tables:
+                continue
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+            if projected_column not in columns:
+                continue
+            for sql in projection_trigger_sql(table, source_column, projected_column):
+                cursor.execute(sql)
+            cursor.execute(
+                f"UPDATE {table} SET {projected_column} = ST_Transform({source_column}, %s) "
+                f"WHERE {source_column} IS NOT NULL AND {projected_column} IS NULL",
+                [PROJECTED_SRID],
+            )
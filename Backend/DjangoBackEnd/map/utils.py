@@ -1,90 +1,129 @@
+import hashlib
+import logging
 import requests
 import json
-import polyline
-from map.models import BusRoute, VtsSituation
+from map.models import BusRoute, DetectedCollision, VtsSituation
+from django.core.cache import cache
 from django.db import connection
-from django.contrib.gis.geos import Polygon
-import time
-def get_trip_geojson(from_place, to_place, num_trips=2):
-    url = "https://api.entur.io/journey-planner/v3/graphql"
-    headers = {
-        'ET-Client-Name': 'TromsøFylkeskommune-svipper-Studenter',
-        'Content-Type': 'application/json'
-    }
+from django.utils import timezone
+from django.contrib.gis.geos import GEOSGeometry
+import numpy as np
+import orjson
+import struct
+from requests.adapters import HTTPAdapter
 
-    query = """
-    {
-    trip(
-      from: {
-        place: "%s"
-      },
-      to: {
-        place: "%s"
-      },
-      numTripPatterns: %d,
-    ) {
-      tripPatterns {
-        legs {
-          mode
-          distance
-          line {
-            id
-            name
-          }
-          fromPlace {
+logger = logging.getLogger(__name__)
+
+ENTUR_JOURNEY_PLANNER_URL = "https://api.entur.io/journey-planner/v3/graphql"
+ENTUR_HEADERS = {
+    'ET-Client-Name': 'TromsøFylkeskommune-svipper-Studenter',
+    'Content-Type': 'application/json'
+}
+ENTUR_REQUEST_TIMEOUT = 10 # seconds
+# Shared by every journey planner call in the process: keeps the TLS connection
+# to Entur open between requests instead of a new handshake per call.
+ENTUR_SESSION = requests.Session()
+ENTUR_SESSION.headers.update(ENTUR_HEADERS)
+ENTUR_SESSION.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+TRIP_QUERY = """
+query Trip($from: String!, $to: String!, $numTripPatterns: Int!) {
+  trip(
+    from: {
+      place: $from
+    },
+    to: {
+      place: $to
+    },
+    numTripPatterns: $numTripPatterns,
+  ) {
+    tripPatterns {
+      legs {
+        mode
+        distance
+        line {
+          id
+          name
+        }
+        fromPlace {
+          name
+          quay {
             name
-            quay {
-              name
-            }
-            latitude
-            longitude
           }
-          toPlace {
+          latitude
+          longitude
+        }
+        toPlace {
+          name
+          quay {
             name
-            quay {
-              name
-            }
-            latitude
-            longitude
-          }
-          pointsOnLink {
-            points
           }
+          latitude
+          longitude
+        }
+        pointsOnLink {
+          points
         }
       }
     }
   }
-    """ % (from_place, to_place, num_trips)
+}
+"""
+# Planned trips change on the order of minutes, so identical requests are answered from the cache
+ENTUR_TRIP_CACHE_TTL = 180 # seconds
+
+def _trip_cache_key(from_place, to_place, num_trips):
+    """Cache key for a trip request; hashed so any user input gives a valid key."""
+    normalized = f"{str(from_place).strip().lower()}|{str(to_place).strip().lower()}|{num_trips}"
+    return "entur_trip:" + hashlib.md5(normalized.encode()).hexdigest()
 
-    payload = {"query": query}
+def get_trip_geojson(from_place, to_place, num_trips=2):
+    """
+    Returns the planned trips between two places as a GeoJSON FeatureCollection,
+    or None on error. Successful results are cached for ENTUR_TRIP_CACHE_TTL seconds
+    in Django's cache, so they are shared by every worker process using that cache.
+    """
+    cache_key = _trip_cache_key(from_place, to_place, num_trips)
+    geojson = cache.get(cache_key)
+    if geojson is None:
+        geojson = _fetch_trip_geojson(from_place, to_place, num_trips)
+        if geojson is not None: # Errors are not cached, the next call retries
+            cache.set(cache_key, geojson, ENTUR_TRIP_CACHE_TTL)
+    return geojson
+
+def _make_trip_leg_feature(leg):
+    """Builds the GeoJSON LineString feature of one trip leg that has pointsOnLink."""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            # Decode polyline points with the vectorized decoder, swapping lat/lng to
+            # lng/lat for GeoJSON compliance in the same array view
+            "coordinates": decode_polyline(leg['pointsOnLink']['points'])[:, ::-1].tolist(),
+        },
+        "properties": {
+            "mode": leg['mode'].lower(),  # Lowercase for consistency
+            "lineName": (leg.get('line') or {}).get('name'), # line is null for e.g. foot legs
+            "distance": leg['distance']
+        }
+    }
+
+def _fetch_trip_geojson(from_place, to_place, num_trips):
+    # The query text is constant; the places are sent as GraphQL variables
+    payload = {
+        "query": TRIP_QUERY,
+        "variables": {"from": from_place, "to": to_place, "numTripPatterns": num_trips},
+    }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = ENTUR_SESSION.post(ENTUR_JOURNEY_PLANNER_URL, json=payload, timeout=ENTUR_REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
-        geojson_features = []
-        for trip_pattern in data['data']['trip']['tripPatterns']:
-            for leg in trip_pattern['legs']:
-                if 'pointsOnLink' in leg and leg['pointsOnLink']:
-                    # Decode polyline points
-                    points = polyline.decode(leg['pointsOnLink']['points'])
-                    # Swap lat/lng to lng/lat for GeoJSON compliance
-                    points = [(lng, lat) for lat, lng in points]
-                    
-                    line_name = leg['line'].get('name') if leg.get('line') else None
-                    geojson_feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": points
-                        },
-                        "properties": {
-                            "mode": leg['mode'].lower(),  # Lowercase for consistency
-                            "lineName": line_name,
-                            "distance": leg['distance']
-                        }
-                    }
-                    geojson_features.append(geojson_feature)
+        data = orjson.loads(response.content) # Parses the raw bytes, no text decode step
+        geojson_features = [
+            _make_trip_leg_feature(leg)
+            for trip_pattern in data['data']['trip']['tripPatterns']
+            for leg in trip_pattern['legs']
+            if leg.get('pointsOnLink')
+        ]
 
         geojson = {
             "type": "FeatureCollection",
@@ -92,95 +131,162 @@ def get_trip_geojson(from_place, to_place, num_trips=2):
         }
         return geojson
 
-    except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError, TypeError) as e:
-        print(f"Error in get_trip_geojson: {e}")
+    except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        logger.error("Error in get_trip_geojson: %s", e)
         return None
 # --- Define your Area of Interest (AOI) ---
 # Replace with actual accurate coordinates for Troms
+# Longitude/latitude in SRID 4326; the collision SQL compares against the plain numbers
 TROMS_BBOX_COORDS = (14.0, 68.2, 22.0, 70.5) # (min_lon, min_lat, max_lon, max_lat)
-TROMS_BBOX_POLYGON = Polygon.from_bbox(TROMS_BBOX_COORDS)
-TROMS_BBOX_POLYGON.srid = 4326
 PROJECTED_SRID = 32633
 
-def calculate_collisions_for_storage(distance_meters: int = 50) -> list:
+# EWKB header pieces: little-endian byte order flag and the "has SRID" type flag
+_EWKB_LITTLE_ENDIAN = b'\x01'
+_EWKB_SRID_FLAG = 0x20000000
+_WKB_POINT = 1
+_WKB_LINESTRING = 2
+# byte order, geometry type (with SRID flag), SRID, x, y
+_EWKB_POINT_STRUCT = struct.Struct('<BIIdd')
+
+def point_from_xy(x, y, srid=4326):
+    """
+    Builds a Point from packed EWKB in a single GEOS call, instead of the several
+    FFI calls (coordinate sequence, SRID set) made by the Point constructor.
+    """
+    return GEOSGeometry(memoryview(_EWKB_POINT_STRUCT.pack(1, _WKB_POINT | _EWKB_SRID_FLAG, srid, x, y)))
+
+def linestring_ewkb(coords, srid=4326):
+    """
+    Packs an (n, 2) array of (x, y) coordinates into LineString EWKB bytes with numpy.
+    Needs no GEOS, so it can also run in worker processes.
+    """
+    coords = np.ascontiguousarray(coords, dtype='<f8')
+    if coords.ndim != 2 or coords.shape[1] != 2 or len(coords) < 2:
+        raise ValueError(f"Expected at least 2 (x, y) coordinates, got array of shape {coords.shape}.")
+    header = (
+        _EWKB_LITTLE_ENDIAN
+        + (_WKB_LINESTRING | _EWKB_SRID_FLAG).to_bytes(4, 'little')
+        + srid.to_bytes(4, 'little')
+        + len(coords).to_bytes(4, 'little')
+    )
+    return header + coords.tobytes()
+
+def linestring_from_array(coords, srid=4326):
+    """
+    Builds a LineString directly from an (n, 2) array of (x, y) coordinates.
+    Packs the EWKB bytes with numpy instead of passing a list of tuples through
+    the LineString constructor, which converts every coordinate in Python.
+    """
+    return GEOSGeometry(memoryview(linestring_ewkb(coords, srid)))
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decodes a Google encoded polyline into an (n, 2) float64 array of (lat, lon).
+    Vectorized replacement for polyline.decode(): every character is unpacked with
+    numpy in one pass instead of bit-twiddling each character in Python.
+    """
+    chars = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if chars.size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    if (chars < 0).any() or chars[-1] & 0x20:
+        raise ValueError("Invalid encoded polyline.")
+    # Each value is a run of 5-bit chunks; the 0x20 bit is set on every chunk but the last
+    value_ends = np.flatnonzero((chars & 0x20) == 0)
+    value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+    value_index = np.repeat(np.arange(len(value_starts)), value_ends - value_starts + 1)
+    shifts = 5 * (np.arange(chars.size) - value_starts[value_index])
+    values = np.bitwise_or.reduceat((chars & 0x1f) << shifts, value_starts)
+    if len(values) % 2:
+        raise ValueError("Invalid encoded polyline: odd number of coordinate values.")
+    # Undo the zigzag sign encoding, then accumulate the (lat, lon) deltas
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 10 ** precision
+
+# SpatiaLite FROM/WHERE shared by every collision query (transit point "t", route "r"):
+# candidate routes come from the R-Tree on BusRoute.path_proj, with a frame of the
+# tolerance around the point, and only those candidates get the exact planar distance
+# check (meters) between the projected copies of the geometries that the database keeps
+# up to date, so nothing is reprojected per pair. Callers may append "AND ..." conditions.
+# Built once at import; the table names never change, and identical SQL lets sqlite3's
+# statement cache reuse the prepared statement.
+COLLISION_FROM_SQL = f"""
+    FROM
+        "{VtsSituation._meta.db_table}" AS t
+    INNER JOIN
+        "{BusRoute._meta.db_table}" AS r ON r.ROWID IN (
+            -- R-Tree lookup: routes whose bounding box reaches the frame around the point
+            SELECT ROWID FROM SpatialIndex
+            WHERE f_table_name = %s
+              AND f_geometry_column = 'path_proj'
+              AND search_frame = BuildCircleMbr(
+                  ST_X(t.location_proj), ST_Y(t.location_proj), %s, %s
+              )
+        )
+    WHERE
+        t.location_proj IS NOT NULL
+        AND ST_Distance(t.location_proj, r.path_proj) <= %s
+"""
+
+def collision_from_params(distance_meters):
+    """Bind parameters of COLLISION_FROM_SQL, in placeholder order."""
+    # Using float() for distance is safer for DB driver compatibility
+    distance = float(distance_meters)
+    return [BusRoute._meta.db_table, distance, PROJECTED_SRID, distance]
+
+def _collision_candidates_sql(distance_meters):
+    """
+    Builds the SELECT that finds the collisions to store, as (sql, params). Its rows are
+    (transit_id, route_id, transit_lon, transit_lat): the COLLISION_FROM_SQL pairs whose
+    transit point lies in the Troms BBOX.
+    Requires SpatiaLite with the spatial indexes created by the GeoDjango migrations.
+    """
+    sql = f"""
+        SELECT
+            t.id AS transit_id,
+            r.id AS route_id,
+            ST_X(t.location) AS transit_lon,
+            ST_Y(t.location) AS transit_lat
+        {COLLISION_FROM_SQL}
+            -- Transit location must be within the BBOX: plain coordinate comparisons
+            -- (same result as ST_Intersects with the BBOX polygon for a point), with
+            -- no WKT parsing per row
+            AND ST_X(t.location) BETWEEN %s AND %s
+            AND ST_Y(t.location) BETWEEN %s AND %s
+    """
+    min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+    # Parameters order must match the %s placeholders
+    params = [
+        *collision_from_params(distance_meters), # R-Tree frame and distance tolerance
+        min_lon, max_lon, min_lat, max_lat,      # BBOX
+    ]
+    return sql, params
+
+def insert_new_collisions(distance_meters: int = 50) -> list:
     """
-    Calculates collisions using Raw SQL (optimized with BBOX filter, using ST_Distance
-    and GeomFromText for SpatiaLite compatibility).
-    Returns details needed for storing in the DetectedCollision model.
-    Requires SpatiaLite + PROJ library correctly configured.
+    Calculates the collisions and stores the ones not stored yet, in a single
+    INSERT OR IGNORE ... SELECT: the unique (transit_information, bus_route) index
+    skips existing pairs, so no rows or pairs are loaded into Python.
+    Database errors propagate, so the caller's transaction can roll back.
 
     Args:
         distance_meters (int): The tolerance distance in meters.
 
     Returns:
-        list: A list of dictionaries, each containing:
-              {'transit_id': int, 'route_id': int, 'transit_lon': float, 'transit_lat': float}
-              Returns an empty list if no collisions are found or on error.
+        list: IDs of the inserted DetectedCollision rows.
     """
-    collision_data_for_storage = []
-    start_calc_time = time.time()
-    print(f"Calculating collisions for storage (Tolerance: {distance_meters}m, Area: Troms BBOX)...")
-
-    try:
-        transit_table = VtsSituation._meta.db_table
-        route_table = BusRoute._meta.db_table
-        bbox_wkt = TROMS_BBOX_POLYGON.wkt
-        bbox_srid = TROMS_BBOX_POLYGON.srid # Should be 4326
-
-        with connection.cursor() as cursor:
-            # Use GeomFromText(wkt, srid) instead of ST_SetSRID(ST_GeomFromText(wkt), srid)
-            sql = f"""
-                SELECT
-                    t.id AS transit_id,
-                    r.id AS route_id,
-                    ST_X(t.location) AS transit_lon,
-                    ST_Y(t.location) AS transit_lat
-                FROM
-                    "{transit_table}" AS t
-                INNER JOIN
-                    "{route_table}" AS r ON t.location IS NOT NULL AND r.path IS NOT NULL
-                WHERE
-                    -- Filter 1: Transit location must be within the BBOX
-                    ST_Intersects(
-                        t.location,
-                        GeomFromText(%s, %s) -- Use GeomFromText with SRID parameter
-                    )
-                    AND
-                    -- Filter 2: Bus route path must intersect the BBOX
-                    ST_Intersects(
-                        r.path,
-                        GeomFromText(%s, %s) -- Use GeomFromText with SRID parameter
-                    )
-                    AND
-                    -- Proximity Check: Using ST_Distance on transformed geometries
-                    ST_Distance(
-                        ST_Transform(t.location, %s), -- Transform point to projected SRID
-                        ST_Transform(r.path, %s)      -- Transform path to projected SRID
-                    ) <= %s                           -- Distance tolerance in meters
-            """
-            # Parameters order must match the %s placeholders
-            params = [
-                bbox_wkt, bbox_srid,           # Parameters for first GeomFromText
-                bbox_wkt, bbox_srid,           # Parameters for second GeomFromText
-                PROJECTED_SRID, PROJECTED_SRID, # Parameters for ST_Transform
-                float(distance_meters)         # Parameter for ST_Distance comparison
-            ]
-            cursor.execute(sql, params)
-
-            # --- Process results (same as before) ---
-            columns = [col[0] for col in cursor.description]
-            rows = cursor.fetchall()
-            for row in rows:
-                result_dict = dict(zip(columns, row))
-                collision_data_for_storage.append(result_dict)
-            # --- End result processing ---
-
-        end_calc_time = time.time()
-        print(f"Raw SQL calculation finished in {end_calc_time - start_calc_time:.2f} seconds. Found {len(collision_data_for_storage)} potential collisions.")
-        return collision_data_for_storage
-
-    except Exception as e:
-        print(f"An error occurred during collision calculation for storage: {e}")
-        # import traceback
-        # traceback.print_exc() # Uncomment for full details if it fails again
-        return []
\ No newline at end of file
+    select_sql, params = _collision_candidates_sql(distance_meters)
+    collision_table = DetectedCollision._meta.db_table
+    sql = f"""
+        INSERT OR IGNORE INTO "{collision_table}" (
+            transit_information_id, bus_route_id, transit_lon, transit_lat,
+            tolerance_meters, detection_timestamp, published_to_mqtt
+        )
+        SELECT c.transit_id, c.route_id, c.transit_lon, c.transit_lat, %s, %s, 0
+        FROM ({select_sql}) AS c
+        RETURNING id
+    """
+    # detection_timestamp is auto_now_add, which only the ORM fills in
+    detected_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [distance_meters, detected_at, *params])
+        return [row[0] for row in cursor.fetchall()]
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Compresses JSON responses; kept before any middleware that reads or changes the response body
+    "django.middleware.gzip.GZipMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -127,6 +129,7 @@ MQTT_BROKER_PORT = 1883
 MQTT_USERNAME = None  # No username needed for default local setup
 MQTT_PASSWORD = None  # No password needed
 MQTT_BASE_COLLISION_TOPIC = 'vts/collisions' 
+MQTT_MAX_BATCH_ITEMS = 200  # Max collisions per published MQTT message
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
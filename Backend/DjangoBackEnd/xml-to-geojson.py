@@ -1,28 +1,167 @@
 import requests
 import logging
-import json
-import xml.etree.ElementTree as ET
-from pyproj import CRS, Transformer
+import orjson
+import gzip
+from lxml import etree as ET
 from dotenv import load_dotenv
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+import numpy as np
+from map.parallel import iter_chunk_results
 
 load_dotenv()
 
 username = os.getenv("brukernavn")
 password = os.getenv("passord")
 
-# Initialize transformer from EPSG:25833 to EPSG:4326
-transformer = Transformer.from_crs("EPSG:25833", "EPSG:4326", always_xy=True)
+# EPSG:25833 (ETRS89 / UTM zone 33N) -> EPSG:4326 in closed form: Krüger's series
+# (Karney 2011) to 4th order in n, accurate to well below a millimetre within the zone.
+# GRS80 ellipsoid; the ETRS89/WGS84 datum difference is ignored, as PROJ does by default.
+UTM_SEMI_MAJOR_AXIS = 6378137.0
+UTM_FLATTENING = 1 / 298.257222101
+UTM_SCALE_FACTOR = 0.9996
+UTM_FALSE_EASTING = 500000.0
+UTM33_CENTRAL_MERIDIAN = np.radians(15.0)
+_n = UTM_FLATTENING / (2 - UTM_FLATTENING) # Third flattening
+# Radius of the rectifying sphere, scaled to the central meridian
+_UTM_SCALED_RADIUS = UTM_SCALE_FACTOR * UTM_SEMI_MAJOR_AXIS / (1 + _n) * (1 + _n**2 / 4 + _n**4 / 64)
+# Series coefficients, from transverse Mercator to conformal sphere (beta) and
+# from conformal to geodetic latitude (delta), for the terms j = 1..4
+_UTM_BETA = np.array([
+    _n / 2 - 2 * _n**2 / 3 + 37 * _n**3 / 96 - _n**4 / 360,
+    _n**2 / 48 + _n**3 / 15 - 437 * _n**4 / 1440,
+    17 * _n**3 / 480 - 37 * _n**4 / 840,
+    4397 * _n**4 / 161280,
+])
+_UTM_DELTA = np.array([
+    2 * _n - 2 * _n**2 / 3 - 2 * _n**3 + 116 * _n**4 / 45,
+    7 * _n**2 / 3 - 8 * _n**3 / 5 - 227 * _n**4 / 45,
+    56 * _n**3 / 15 - 136 * _n**4 / 35,
+    4279 * _n**4 / 630,
+])
+_UTM_2J = 2 * np.arange(1, 5)
+
+
+def utm33n_to_wgs84(easting, northing):
+    """Convert arrays of EPSG:25833 eastings/northings to (lon, lat) arrays in degrees."""
+    xi = northing / _UTM_SCALED_RADIUS
+    eta = (easting - UTM_FALSE_EASTING) / _UTM_SCALED_RADIUS
+    # One column per series term
+    xi_2j = np.multiply.outer(xi, _UTM_2J)
+    eta_2j = np.multiply.outer(eta, _UTM_2J)
+    xi_prime = xi - (_UTM_BETA * np.sin(xi_2j) * np.cosh(eta_2j)).sum(axis=-1)
+    eta_prime = eta - (_UTM_BETA * np.cos(xi_2j) * np.sinh(eta_2j)).sum(axis=-1)
+    # Conformal latitude, then geodetic latitude
+    chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+    lat = chi + (_UTM_DELTA * np.sin(np.multiply.outer(chi, _UTM_2J))).sum(axis=-1)
+    lon = UTM33_CENTRAL_MERIDIAN + np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+    return np.degrees(lon), np.degrees(lat)
+
+# DATEX II namespaces
+namespaces = {
+    'ns2': 'http://datex2.eu/schema/3/messageContainer',
+    'ns3': 'http://datex2.eu/schema/3/cisInformation',
+    'ns4': 'http://datex2.eu/schema/3/exchangeInformation',
+    'ns5': 'http://datex2.eu/schema/3/informationManagement',
+    'ns6': 'http://datex2.eu/schema/3/dataDictionaryExtension',
+    'ns7': 'http://datex2.eu/schema/3/cctvExtension',
+    'ns8': 'http://datex2.eu/schema/3/locationReferencing',
+    'ns9': 'http://datex2.eu/schema/3/alertCLocationCodeTableExtension',
+    'ns10': 'http://datex2.eu/schema/3/roadTrafficData',
+    'ns11': 'http://datex2.eu/schema/3/vms',
+    'ns12': 'http://datex2.eu/schema/3/situation',
+    'ns0': 'http://datex2.eu/schema/3/common'
+}
+
+
+def _xpath(path):
+    """Compile an XPath once, bound to the DATEX namespaces."""
+    return ET.XPath(path, namespaces=namespaces, smart_strings=False)
+
+
+def _first(xpath, element):
+    """Evaluate a compiled XPath and return the first result or None, like find()."""
+    result = xpath(element)
+    return result[0] if result else None
+
+
+def _first_in(xpath, elements):
+    """Evaluate a compiled XPath on each element in turn and return the first result or None."""
+    for element in elements:
+        result = xpath(element)
+        if result:
+            return result[0]
+    return None
+
+
+def _text(element, default):
+    """Return the text of an element found by _first()/_first_in(), or default if it is None."""
+    return element.text if element is not None else default
+
+
+# Fully qualified tag of the situations streamed out of the payload
+SITUATION_TAG = f"{{{namespaces['ns12']}}}situation"
+
+# libxml2 options for iterparse and the worker-side parser: no xml:id table and no
+# whitespace-only text between elements (neither is ever read), no entity expansion,
+# and no size limits on large snapshots
+PARSER_OPTIONS = {
+    'collect_ids': False,
+    'remove_blank_text': True,
+    'resolve_entities': False,
+    'huge_tree': True,
+}
+SITUATION_PARSER = ET.XMLParser(**PARSER_OPTIONS)
+
+# Precompiled lookups, evaluated for every situation.
+# Explicit child steps down to the records' fields, so a lookup no longer walks
+# the whole situation subtree.
+_RECORD = 'ns12:situationRecord'
+SEVERITY_XPATH = _xpath(f'{_RECORD}/ns12:severity')
+COMMENTS_XPATH = _xpath(f'{_RECORD}/ns12:generalPublicComment/ns12:comment')
+SITUATION_TYPE_XPATH = _xpath(f'{_RECORD}/ns12:probabilityOfOccurrence')
+ROAD_CLOSE_XPATH = _xpath(f'{_RECORD}/ns12:roadOrCarriagewayOrLaneManagementType')
+LOCATION_REFERENCES_XPATH = _xpath(f'{_RECORD}/ns12:locationReference')
+
+# The nesting below locationReference depends on the location type (e.g. locations
+# contained in a group), so these elements are collected in a single iter() pass over
+# each locationReference instead of one descendant query per field
+LOCATION_DESCRIPTION_TAG = f"{{{namespaces['ns8']}}}locationDescription"
+ROAD_INFORMATION_TAG = f"{{{namespaces['ns8']}}}roadInformation"
+NAMED_AREA_TAG = f"{{{namespaces['ns8']}}}namedArea"
+GML_LINE_STRING_TAG = f"{{{namespaces['ns8']}}}gmlLineString"
+COORDINATES_FOR_DISPLAY_TAG = f"{{{namespaces['ns8']}}}coordinatesForDisplay"
+LOCATION_TAGS = (
+    LOCATION_DESCRIPTION_TAG,
+    ROAD_INFORMATION_TAG,
+    NAMED_AREA_TAG,
+    GML_LINE_STRING_TAG,
+    COORDINATES_FOR_DISPLAY_TAG,
+)
+# Relative to a roadInformation:
+ROAD_NAME_XPATH = _xpath('ns8:roadName')
+ROAD_NUMBER_XPATH = _xpath('ns8:roadNumber')
+# Relative to a namedArea:
+COUNTY_XPATH = _xpath('ns8:areaName/ns0:values/ns0:value')
+# Relative to a coordinatesForDisplay:
+LATITUDE_XPATH = _xpath('ns8:latitude')
+LONGITUDE_XPATH = _xpath('ns8:longitude')
+# Relative to a comment or locationDescription:
+VALUES_XPATH = _xpath('ns0:values')
+VALUE_XPATH = _xpath('ns0:value')
+# Relative to a gmlLineString:
+POS_LIST_XPATH = _xpath('ns8:posList')
 
 def is_epsg_4326(lon, lat):
-    """Check if coordinates are already in EPSG:4326 (lon/lat or lat/lon format)."""
-    # Assuming lon, lat are input as lon, lat
-    if -180 <= lon <= 180 and -90 <= lat <= 90:
-        return True
-    # Swap the coordinates and check again if they were provided as lat, lon
-    elif -90 <= lon <= 90 and -180 <= lat <= 180:
-        return True
-    return False
+    """
+    Check if coordinates are already in EPSG:4326 (lon/lat or lat/lon format).
+    Works element-wise on numpy arrays, returning a boolean mask.
+    """
+    abs_lon, abs_lat = np.abs(lon), np.abs(lat)
+    # Assuming lon, lat are input as lon, lat,
+    # or swapped if they were provided as lat, lon
+    return ((abs_lon <= 180) & (abs_lat <= 90)) | ((abs_lon <= 90) & (abs_lat <= 180))
 
 
 # Function to read credentials from a text file
@@ -43,183 +182,244 @@ logging.basicConfig(level=logging.INFO)
 # Define URL
 url = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata?srti=True"
 
+# Number of worker processes converting situations to features (1 = convert them in this process)
+WORKERS = int(os.getenv("XML_TO_GEOJSON_WORKERS", os.cpu_count() or 1))
+# Number of situations handed to a worker process at a time
+SITUATION_CHUNK_SIZE = 100
+# Below this many situations, starting worker processes costs more than it saves
+PARALLEL_MIN_SITUATIONS = 1000
+
 # If credentials are not found, exit
 if not username or not password:
     logging.error("No valid credentials found. Exiting...")
     exit(1)
 
 # Fetch XML data from the API
+# Returns the streamed response; its body is read while it is parsed
 def fetch_xml_data():
     logging.info("Fetching XML data from the API...")
     try:
-        response = requests.get(url, auth=(username, password))
+        response = requests.get(url, auth=(username, password), stream=True)
         response.raise_for_status()  # Raise an error for bad status codes
-        logging.info("Successfully fetched data.")
-        return response.text
+        logging.info("Successfully connected, streaming data.")
+        response.raw.decode_content = True  # raw is the undecoded stream; inflate gzip while it is read
+        return response
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching XML data: {e}")
         return None
-    
-# Function to parse XML and convert to GeoJSON
-def parse_xml_to_geojson(xml_data):
+
+
+def iter_situations(xml_source):
+    """
+    Yield each situation element of the payload read from `xml_source` as soon as its
+    end tag is parsed. When the next one is requested, the previous situation is emptied
+    and removed from the tree, so the tree never holds more than one situation.
+    """
+    for _, situation in ET.iterparse(xml_source, events=("end",), tag=SITUATION_TAG, **PARSER_OPTIONS):
+        yield situation
+        situation.clear()
+        while situation.getprevious() is not None:
+            del situation.getparent()[0]
+
+
+def situation_to_feature(situation):
+    """Convert one situation element to a GeoJSON feature, or None if it has no valid geometry."""
+    situation_id = situation.attrib.get('id', 'Unknown')
+    logging.info(f"Processing situation with ID: {situation_id}")
+
+    # Collect the location elements of every record in one pass, in document order
+    location_elements = {tag: [] for tag in LOCATION_TAGS}
+    for location_reference in LOCATION_REFERENCES_XPATH(situation):
+        for element in location_reference.iter(*LOCATION_TAGS):
+            location_elements[element.tag].append(element)
+    road_informations = location_elements[ROAD_INFORMATION_TAG]
+
+    # Extracting additional properties, as text if the element exists, otherwise the default
+    severity_text = _text(_first(SEVERITY_XPATH, situation), "Unknown")
+    comments = COMMENTS_XPATH(situation)
+    county_text = _text(_first_in(COUNTY_XPATH, location_elements[NAMED_AREA_TAG]), "Unknown")
+    situation_type_text = _text(_first(SITUATION_TYPE_XPATH, situation), "Unknown")
+    # Extract Road Name & Road Number
+    road_name_text = _text(_first_in(ROAD_NAME_XPATH, road_informations), "Unknown Road Name")
+    road_number_text = _text(_first_in(ROAD_NUMBER_XPATH, road_informations), "Unknown Road Number")
+    roadclose_text = _text(_first(ROAD_CLOSE_XPATH, situation), "unknown")
+
+    # Collect all location descriptions, skipping duplicates as they are
+    # collected so the list keeps the order of first occurrence
+    location_description_text = []
+    seen = set()
+
+    # Extract locationDescriptions
+    location_descriptions = location_elements[LOCATION_DESCRIPTION_TAG]
+
+    for location_description in location_descriptions:
+        values = _first(VALUES_XPATH, location_description)  # Ensure correct namespace
+        if values is not None:
+            value = _first(VALUE_XPATH, values)
+            if value is not None:
+                text = value.text.strip()  # Strip leading/trailing spaces
+            else:
+                text = "No value element found in values"
+        else:
+            text = "No values element found for location description."
+        if text not in seen:
+            seen.add(text)
+            location_description_text.append(text)
+
+    # Collect all comments, deduplicated the same way
+    comment_text = []
+    seen = set()
+
+    for comment in comments:
+        values = _first(VALUES_XPATH, comment)
+        if values is not None:
+            value = _first(VALUE_XPATH, values)
+            text = value.text.strip() if value is not None else "no value found"
+        else:
+            text = "no values found"
+        if text not in seen:
+            seen.add(text)
+            comment_text.append(text)
+
+    # Extract LineString coordinates (if available)
+    gml_line_elements = location_elements[GML_LINE_STRING_TAG]
+    coordinates = np.empty((0, 2))  # (lon, lat) rows, serialized as-is by orjson
+
+    if gml_line_elements:
+        first_gml_line = gml_line_elements[0]  # Only process the first gmlLineString
+        pos_list = _first(POS_LIST_XPATH, first_gml_line)
+        if pos_list is not None and pos_list.text:
+            # Parse the posList text straight into (first, second) coordinate pairs in C,
+            # without splitting it into Python strings first
+            extracted_coords = np.fromstring(pos_list.text, dtype=np.float64, sep=' ').reshape(-1, 2)
+            first, second = extracted_coords[:, 0], extracted_coords[:, 1]
+
+            # (lon, lat) rows are written straight into one (N, 2) output array
+            if first.size and np.abs(first).min() > 180:
+                # Common case: every pair is a UTM easting/northing, so the whole list is
+                # transformed from EPSG:25833 to EPSG:4326 without a per-pair mask
+                coordinates = np.empty_like(extracted_coords)
+                coordinates[:, 0], coordinates[:, 1] = utm33n_to_wgs84(first, second)
+            else:
+                # Pairs already in EPSG:4326 only get swapped to (lon, lat)
+                coordinates = extracted_coords[:, ::-1].copy()
+                to_transform = ~is_epsg_4326(first, second)
+                if to_transform.any():
+                    # Transform the remaining pairs in one vectorized call
+                    coordinates[to_transform, 0], coordinates[to_transform, 1] = utm33n_to_wgs84(
+                        first[to_transform], second[to_transform]
+                    )
+
+            logging.info(f"Extracted {len(coordinates)} coordinate pairs for situation {situation_id}.")
+
+    # Extract Point
+    display_coordinates = location_elements[COORDINATES_FOR_DISPLAY_TAG]
+    lat_element = _first_in(LATITUDE_XPATH, display_coordinates)
+    lon_element = _first_in(LONGITUDE_XPATH, display_coordinates)
+    point_coordinates = [float(lon_element.text), float(lat_element.text)] if lat_element is not None and lon_element is not None else None
+
+    # Create GeoJSON feature
+    feature = {
+        "type": "Feature",
+        "properties": {
+            "id": situation_id,
+            "name": road_name_text, 
+            "road_number" : road_number_text,
+            "description": " | ".join(location_description_text),  # Concatenate descriptions
+            "severity": severity_text,
+            "comment": "".join(comment_text),
+            "county": county_text,
+            "situation_type": situation_type_text,
+            "road close" : roadclose_text
+        },
+        "geometry": {}
+    }
+
+    # Add geometry type based on available coordinates
+    has_line = len(coordinates) > 0
+    if has_line and point_coordinates:
+        feature["geometry"]["type"] = "GeometryCollection"
+        feature["geometry"]["geometries"] = [
+            {
+                "type": "LineString",
+                "coordinates": coordinates
+            },
+            {
+                "type": "Point",
+                "coordinates": point_coordinates
+            }
+        ]
+    elif has_line:
+        feature["geometry"]["type"] = "LineString"
+        feature["geometry"]["coordinates"] = coordinates
+    elif point_coordinates:
+        feature["geometry"]["type"] = "Point"
+        feature["geometry"]["coordinates"] = point_coordinates
+    else:
+        logging.warning(f"No valid geometry found for situation {situation_id}. Skipping.")
+
+    # Return the feature only if it has valid geometry
+    return feature if "type" in feature["geometry"] else None
+
+
+def situations_to_features(situation_chunk):
+    """Convert a chunk of serialized situations to features. Runs in the worker processes."""
+    return [situation_to_feature(ET.fromstring(situation_xml, SITUATION_PARSER)) for situation_xml in situation_chunk]
+
+
+def iter_situation_chunks(situations):
+    """Serialize situations into lists of SITUATION_CHUNK_SIZE XML byte strings."""
+    chunk = []
+    for situation in situations:
+        chunk.append(ET.tostring(situation, with_tail=False))
+        if len(chunk) >= SITUATION_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_features(xml_source, workers=WORKERS):
+    """
+    Yield the situation_to_feature() result of every situation, in document order.
+
+    With more than one worker, situations are serialized and converted in a process pool,
+    keeping at most two chunks per worker in flight so the body is still streamed.
+    Payloads with fewer than PARALLEL_MIN_SITUATIONS situations are converted in this process.
+    """
+    situations = iter_situations(xml_source)
+    if workers <= 1:
+        for situation in situations:
+            yield situation_to_feature(situation)
+        return
+
+    chunks = iter_situation_chunks(situations)
+    # Buffer the head of the payload to find out whether it is large enough for the pool
+    head = list(islice(chunks, PARALLEL_MIN_SITUATIONS // SITUATION_CHUNK_SIZE + 1))
+    if sum(len(chunk) for chunk in head) < PARALLEL_MIN_SITUATIONS:
+        for chunk in head:
+            yield from situations_to_features(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from iter_chunk_results(executor, situations_to_features, chain(head, chunks), 2 * workers)
+
+# Function to parse XML (read from a file-like object) and convert to GeoJSON
+def parse_xml_to_geojson(xml_source):
     logging.info("Parsing XML data...")
     try:
-        # Define namespaces
-        namespaces = {
-            'ns2': 'http://datex2.eu/schema/3/messageContainer',
-            'ns3': 'http://datex2.eu/schema/3/cisInformation',
-            'ns4': 'http://datex2.eu/schema/3/exchangeInformation',
-            'ns5': 'http://datex2.eu/schema/3/informationManagement',
-            'ns6': 'http://datex2.eu/schema/3/dataDictionaryExtension',
-            'ns7': 'http://datex2.eu/schema/3/cctvExtension',
-            'ns8': 'http://datex2.eu/schema/3/locationReferencing',
-            'ns9': 'http://datex2.eu/schema/3/alertCLocationCodeTableExtension',
-            'ns10': 'http://datex2.eu/schema/3/roadTrafficData',
-            'ns11': 'http://datex2.eu/schema/3/vms',
-            'ns12': 'http://datex2.eu/schema/3/situation',
-            'ns0': 'http://datex2.eu/schema/3/common'
-        }
-
-        # Parse the XML data
-        root = ET.fromstring(xml_data)
+        geojson_features = []
+        situation_count = 0
 
-        # Find all situations
-        situations = root.findall('.//ns12:situation', namespaces)
+        for feature in iter_features(xml_source):
+            situation_count += 1
+            if feature is not None:
+                geojson_features.append(feature)
 
-        if not situations:
+        if not situation_count:
             logging.warning("No situations found in the XML data.")
             return None
 
-        geojson_features = []
-
-        for situation in situations:
-            situation_id = situation.attrib.get('id', 'Unknown')
-            logging.info(f"Processing situation with ID: {situation_id}")
-
-            # Extracting additional properties
-            severity = situation.find('.//ns12:severity', namespaces)
-            comments = situation.findall('.//ns12:generalPublicComment/ns12:comment', namespaces)
-            county = situation.find('.//ns8:namedArea/ns8:areaName/ns0:values/ns0:value', namespaces)
-            situation_type = situation.find('.//ns12:situationRecord/ns12:probabilityOfOccurrence', namespaces)
-            # Extract Road Name & Road Number
-            road_name_element = situation.find('.//ns8:roadInformation/ns8:roadName', namespaces)
-            road_number_element = situation.find('.//ns8:roadInformation/ns8:roadNumber', namespaces)
-            roadclose = situation.find('.//ns12:roadOrCarriagewayOrLaneManagementType', namespaces)
-
-            # Convert to text if element exists, otherwise use default
-            severity_text = severity.text if severity is not None else "Unknown"
-            roadclose_text = roadclose.text if roadclose is not None else "unknown"
-            county_text = county.text if county is not None else "Unknown"
-            situation_type_text = situation_type.text if situation_type is not None else "Unknown"
-            road_name_text = road_name_element.text if road_name_element is not None else "Unknown Road Name"
-            road_number_text = road_number_element.text if road_number_element is not None else "Unknown Road Number"
-
-            # Collect all location descriptions
-            location_description_text = []
-
-            # Extract locationDescriptions
-            location_descriptions = situation.findall('.//ns8:locationDescription', namespaces)
-
-            for location_description in location_descriptions:
-                values = location_description.find('.//ns0:values', namespaces)  # Ensure correct namespace
-                if values is not None:
-                    value = values.find('.//ns0:value', namespaces)
-                    if value is not None:
-                        location_description_text.append(value.text.strip())  # Strip leading/trailing spaces
-                    else:
-                        location_description_text.append("No value element found in values")
-                else:
-                    location_description_text.append("No values element found for location description.")
-
-            # Remove duplicates while maintaining order
-            location_description_text = list(dict.fromkeys(location_description_text))
-            # Collect all comments
-            comment_text = []
-
-            for comment in comments:
-                values = comment.find('.//ns0:values', namespaces)
-                if values is not None:
-                    value = values.find('.//ns0:value', namespaces)
-                    if value is not None:
-                        comment_text.append(value.text.strip())
-                    else:
-                        comment_text.append("no value found")
-                else:
-                    comment_text.append("no values found")
-                    
-            comment_text = list(dict.fromkeys(comment_text))
-                    
-            # Extract LineString coordinates (if available)
-            gml_line_elements = situation.findall('.//ns8:gmlLineString', namespaces)
-            coordinates = []
-
-            if gml_line_elements:
-                first_gml_line = gml_line_elements[0]  # Only process the first gmlLineString
-                pos_list = first_gml_line.find('.//ns8:posList', namespaces)
-                if pos_list is not None and pos_list.text:
-                    coord_list = list(map(float, pos_list.text.split()))
-                    extracted_coords = [(coord_list[i], coord_list[i+1]) for i in range(0, len(coord_list), 2)]
-
-                    transformed_coords = []
-                    for lat, lon in extracted_coords:
-                        if is_epsg_4326(lat, lon):
-                            transformed_coords.append((lon, lat))  # Already in EPSG:4326
-                        else:
-                            # Transform from EPSG:25833 to EPSG:4326
-                            new_lat, new_lon = transformer.transform(lat, lon)
-                            transformed_coords.append((new_lat, new_lon))
-            
-                    coordinates = transformed_coords
-                    logging.info(f"Extracted {len(coordinates)} coordinate pairs for situation {situation_id}.")
-    
-            # Extract Point
-            lat_element = situation.find('.//ns8:coordinatesForDisplay/ns8:latitude', namespaces)
-            lon_element = situation.find('.//ns8:coordinatesForDisplay/ns8:longitude', namespaces)
-            point_coordinates = [float(lon_element.text), float(lat_element.text)] if lat_element is not None and lon_element is not None else None
-
-            # Create GeoJSON feature
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "id": situation_id,
-                    "name": road_name_text, 
-                    "road_number" : road_number_text,
-                    "description": " | ".join(location_description_text),  # Concatenate descriptions
-                    "severity": severity_text,
-                    "comment": "".join(comment_text),
-                    "county": county_text,
-                    "situation_type": situation_type_text,
-                    "road close" : roadclose_text
-                },
-                "geometry": {}
-            }
-
-            # Add geometry type based on available coordinates
-            if coordinates and point_coordinates:
-                feature["geometry"]["type"] = "GeometryCollection"
-                feature["geometry"]["geometries"] = [
-                    {
-                        "type": "LineString",
-                        "coordinates": coordinates
-                    },
-                    {
-                        "type": "Point",
-                        "coordinates": point_coordinates
-                    }
-                ]
-            elif coordinates:
-                feature["geometry"]["type"] = "LineString"
-                feature["geometry"]["coordinates"] = coordinates
-            elif point_coordinates:
-                feature["geometry"]["type"] = "Point"
-                feature["geometry"]["coordinates"] = point_coordinates
-            else:
-                logging.warning(f"No valid geometry found for situation {situation_id}. Skipping.")
-
-            # Add feature only if it has valid geometry
-            if "type" in feature["geometry"]:
-                geojson_features.append(feature)
-
         # Create the GeoJSON feature collection
         geojson = {
             "type": "FeatureCollection",
@@ -237,8 +437,14 @@ def parse_xml_to_geojson(xml_data):
 def save_geojson(geojson, filename='output.geojson'):
     logging.info(f"Saving GeoJSON data to {filename}...")
     try:
-        with open(filename, 'w') as geojson_file:
-            json.dump(geojson, geojson_file, indent=4)
+        # orjson serializes the coordinate arrays directly, without Python float lists
+        data = orjson.dumps(geojson, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        with open(filename, 'wb') as geojson_file:
+            geojson_file.write(data)
+        # Precompressed copy for clients that accept gzip; written after the plain file,
+        # since the serving view only uses it when it is at least as new
+        with gzip.open(f"{filename}.gz", 'wb') as gz_file:
+            gz_file.write(data)
         logging.info(f"GeoJSON data successfully saved to {filename}")
     except Exception as e:
         logging.error(f"Error saving GeoJSON data: {e}")
@@ -246,11 +452,12 @@ def save_geojson(geojson, filename='output.geojson'):
 # Main function to orchestrate fetching, parsing, and saving data
 def main():
     # Fetch the XML data
-    xml_data = fetch_xml_data()
+    response = fetch_xml_data()
     
-    if xml_data:
-        # Parse XML to GeoJSON
-        geojson = parse_xml_to_geojson(xml_data)
+    if response is not None:
+        # Parse XML to GeoJSON while the body streams in
+        with response:
+            geojson = parse_xml_to_geojson(response.raw)
         
         if geojson:
             # Save GeoJSON to file
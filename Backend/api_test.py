@@ -1,6 +1,6 @@
 import requests
 import os
-import xml.etree.ElementTree as ET
+from lxml import etree
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +8,7 @@ load_dotenv()
 url = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata?srti=True"
 #ferry information
 url2 = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata/filter/AbnormalTraffic"
+SITUATION_RECORD_TAG = "{http://datex2.eu/schema/3/situation}situationRecord"
 """
 Filters:
 • AbnormalTraffic
@@ -33,15 +34,17 @@ auth = ("brukernavn", "passord") # i .env fil
 
 API_USERNAME = os.getenv("brukernavn")
 API_PASSWORD = os.getenv("passord")
-response = requests.get(url, auth=(API_USERNAME, API_PASSWORD))
+# stream=True: the XML is parsed while it downloads instead of being buffered first
+response = requests.get(url, auth=(API_USERNAME, API_PASSWORD), stream=True)
 # Check if response is successful
 if response.status_code == 200:
-    # Parse XML response
-    root = ET.fromstring(response.text)
-
-    # Example: Print all tag names and values
-    for elem in root.iter():
-        print(f"{elem.tag}: {elem.text}")
+    response.raw.decode_content = True  # Let urllib3 undo gzip before lxml reads it
+    # Parse XML response one situation record at a time
+    for _, record in etree.iterparse(response.raw, events=('end',), tag=SITUATION_RECORD_TAG):
+        # Example: Print all tag names and values
+        for elem in record.iter():
+            print(f"{elem.tag}: {elem.text}")
+        record.clear()  # Free the record so memory stays bounded whatever the feed size
 
 else:
     print(f"Error: {response.status_code}")
\ No newline at end of file